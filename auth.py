@@ -4,11 +4,10 @@ import hmac
 import hashlib
 import json
 import urllib.parse
-from fastapi import APIRouter, Request, Depends
+from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
-from sqlalchemy.orm import Session
-from database import SessionLocal  # Ensure your database.py defines SessionLocal and engine
+from database import SessionLocal, run_db  # Ensure your database.py defines SessionLocal and engine
 from models import User         # Your User model defined in models.py
 
 load_dotenv()
@@ -26,14 +25,6 @@ else:
 
 print("BOT_TOKEN:", BOT_TOKEN)
 
-# Dependency to get a database session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 def verify_telegram_auth(init_data: str) -> dict:
     """
     Verify Telegram initData and return user info if valid; otherwise return {}.
@@ -91,8 +82,31 @@ def verify_telegram_auth(init_data: str) -> dict:
         print(f"Error verifying Telegram auth data: {e}")
         return {}
 
+def upsert_telegram_user(telegram_id: str, username: str, photo_url: str) -> dict:
+    """
+    Create or update the stored user record and return it as a dict.
+    Blocking; call through run_db from async code.
+    """
+    with SessionLocal() as db:
+        user = db.query(User).filter(User.telegram_id == telegram_id).first()
+        if user:
+            user.username = username  # Optionally update if changed
+            user.photo_url = photo_url
+            print(f"[DEBUG] Existing user updated in DB: {telegram_id} - {username}")
+        else:
+            user = User(
+                telegram_id=telegram_id,
+                username=username,
+                photo_url=photo_url
+            )
+            db.add(user)
+            print(f"[DEBUG] New user created in DB: {telegram_id} - {username}")
+        db.commit()
+        db.refresh(user)
+        return {"id": user.id, "telegram_id": user.telegram_id, "username": user.username, "photo_url": user.photo_url}
+
 @router.post("/auth/telegram")
-async def telegram_auth(request: Request, db: Session = Depends(get_db)):
+async def telegram_auth(request: Request):
     """
     Endpoint for mini app auth.
     Expects a JSON body: { "initData": "<telegram init data string>" }.
@@ -116,26 +130,12 @@ async def telegram_auth(request: Request, db: Session = Depends(get_db)):
         print("[DEBUG] User ID missing in auth data.")
         return JSONResponse({"success": False, "error": "User ID missing"}, status_code=400)
 
-    # Cross-reference or update the stored user record
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
+    # Cross-reference or update the stored user record (on the DB thread pool)
     username = user_info.get("username") or user_info.get("first_name", "Telegram User")
     photo_url = user_info.get("photo_url") or "/images/default_avatar.png"
-    if user:
-        user.username = username  # Optionally update if changed
-        user.photo_url = photo_url
-        print(f"[DEBUG] Existing user updated in DB: {telegram_id} - {username}")
-    else:
-        user = User(
-            telegram_id=telegram_id,
-            username=username,
-            photo_url=photo_url
-        )
-        db.add(user)
-        print(f"[DEBUG] New user created in DB: {telegram_id} - {username}")
-    db.commit()
-    db.refresh(user)
-    print("[DEBUG] Auth successful. User stored in DB:", user.telegram_id, user.username)
-    return {"success": True, "user": {"id": user.id, "telegram_id": user.telegram_id, "username": user.username, "photo_url": user.photo_url}}
+    user = await run_db(upsert_telegram_user, telegram_id, username, photo_url)
+    print("[DEBUG] Auth successful. User stored in DB:", user["telegram_id"], user["username"])
+    return {"success": True, "user": user}
 
 @router.post("/auth/logout")
 async def logout():
@@ -0,0 +1,75 @@
+"""
+Latency of ESIMAccess calls with a new aiohttp session per request (the old api_post)
+versus the shared pooled session, against a local stub of the API.
+
+    DATABASE_URL=sqlite:///bench.db python bench/http_session_latency.py [requests]
+
+Runs the balance query sequentially and prints p50/p99 per mode. The stub is plain HTTP
+on loopback, so the real gain (TLS handshakes to the API) is larger than shown here.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import statistics
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import buy_esim  # noqa: E402
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+
+async def balance(request: web.Request) -> web.Response:
+    return web.json_response({"success": True, "obj": {"balance": 100000}})
+
+
+async def per_request_session(url: str) -> dict:
+    async with aiohttp.ClientSession(headers=buy_esim.API_HEADERS) as session:
+        async with session.post(url, json={}) as response:
+            return await response.json()
+
+
+async def shared_session(url: str) -> dict:
+    return await buy_esim.api_post(url, payload={})
+
+
+def percentile(samples, pct: float) -> float:
+    return statistics.quantiles(samples, n=100, method="inclusive")[int(pct) - 1]
+
+
+async def measure(call, url: str) -> list:
+    samples = []
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        await call(url)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def main() -> None:
+    app = web.Application()
+    app.router.add_post("/api/v1/open/balance/query", balance)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}/api/v1/open/balance/query"
+
+    await buy_esim.start_http_session()
+    try:
+        for name, call in (("per-request session", per_request_session), ("shared session", shared_session)):
+            await measure(call, url)  # warm-up
+            samples = await measure(call, url)
+            print(f"{name:>20}: p50 {percentile(samples, 50):.3f} ms, p99 {percentile(samples, 99):.3f} ms")
+    finally:
+        await buy_esim.close_http_session()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
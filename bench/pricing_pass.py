@@ -0,0 +1,104 @@
+"""
+Time of the pricing pass (pricing.price_catalog) versus the old adjust_prices loop on the
+package lists in public/, scaled up and with randomised retail prices.
+
+    python bench/pricing_pass.py [runs]
+
+Prints the best CPU time of [runs] per scale for the old loop, the default rule and a four-rule set,
+and checks that the default rule gives the same retail prices as the old loop.
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import random
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import pricing  # noqa: E402
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+SCALES = (1, 10, 100)
+FILES = ("allPackages.json", "countryPackages.json", "regionalPackages.json", "globalPackages.json")
+
+RULES_4 = [
+    pricing.PricingRule("de-small", locations=["DE"], max_volume_gb=1, cap_bp=40000),
+    pricing.PricingRule("global", kinds=[pricing.KIND_GLOBAL], floor_bp=20000),
+    pricing.PricingRule("big", min_volume_gb=50, cap_bp=25000),
+    *pricing.DEFAULT_RULES,
+]
+
+
+def adjust_prices(packages):
+    """The loop server.py used before pricing.py."""
+    for package in packages:
+        if "retailPrice" in package and "price" in package:
+            if package["retailPrice"] == 0:
+                package["retailPrice"] = package["price"] * 3
+            elif 0 < package["retailPrice"] <= package["price"]:
+                package["retailPrice"] = package["price"] * 1.5
+            elif package["retailPrice"] > package["price"] * 3:
+                package["retailPrice"] = package["price"] * 3
+    return packages
+
+
+def load_files(scale: int) -> dict:
+    rng = random.Random(scale)
+    files = {}
+    for filename in FILES:
+        with open(os.path.join(ROOT, "public", filename), encoding="utf-8") as f:
+            packages = json.load(f)
+        scaled = []
+        for _ in range(scale):
+            for pkg in packages:
+                pkg = dict(pkg)
+                if "price" in pkg:
+                    pkg["retailPrice"] = rng.choice((0, pkg["price"], pkg["price"] * 2, pkg["price"] * 5))
+                scaled.append(pkg)
+        files[filename] = scaled
+    return files
+
+
+def timed(files: dict, modes: dict) -> dict:
+    """Best CPU time in ms of each mode, alternating between modes on every run."""
+    best = {name: float("inf") for name in modes}
+    for _ in range(RUNS):
+        for name, run in modes.items():
+            fresh = copy.deepcopy(files)
+            start = time.process_time()
+            run(fresh)
+            best[name] = min(best[name], time.process_time() - start)
+    return {name: seconds * 1000 for name, seconds in best.items()}
+
+
+def main():
+    for scale in SCALES:
+        files = load_files(scale)
+        count = sum(len(packages) for packages in files.values())
+
+        old = copy.deepcopy(files)
+        for packages in old.values():
+            adjust_prices(packages)
+        new = copy.deepcopy(files)
+        pricing.price_catalog(new, pricing.DEFAULT_RULES)
+        mismatches = sum(
+            int(a.get("retailPrice", 0)) != b.get("retailPrice", 0) or "pricingRule" in b
+            for name in files for a, b in zip(old[name], new[name])
+        )
+
+        ms = timed(files, {
+            "old": lambda f: [adjust_prices(packages) for packages in f.values()],
+            "default rule": lambda f: pricing.price_catalog(f, pricing.DEFAULT_RULES),
+            "4 rules": lambda f: pricing.price_catalog(f, RULES_4),
+        })
+        print(
+            f"{scale:>4}x {count:>7} packages: "
+            + "  ".join(f"{name} {value:8.2f} ms" for name, value in ms.items())
+            + f"  mismatches {mismatches}"
+        )
+
+
+if __name__ == "__main__":
+    main()
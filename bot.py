@@ -12,7 +12,7 @@ import logging
 import asyncio
 import os
 import json
-from typing import Optional
+from typing import Optional, Tuple
 
 from telegram import (
     Update,
@@ -31,9 +31,11 @@ from telegram.ext import (
 )
 from dotenv import load_dotenv
 
-from database import SessionLocal, engine, Base
-from models import User, Order
+from database import BotSessionLocal, engine, Base, pool_metrics, run_db
+from models import User, Order, migrate_schema
 import buy_esim
+import catalog
+from callback_router import CallbackRouter
 
 # Load environment variables
 load_dotenv()
@@ -45,61 +47,17 @@ NEWS_CHANNEL = os.getenv("NEWS_CHANNEL")
 WEBAPP_FAQ_URL = os.getenv("WEBAPP_FAQ_URL")
 WEBAPP_GUIDES_URL = os.getenv("WEBAPP_GUIDES_URL")
 
-# ====== Load JSON Data Files ======
-try:
-    with open("public/countries.json", encoding="utf-8") as f:
-        countries_data = json.load(f)
-    COUNTRIES = [{"code": code, "name": name} for code, name in countries_data.items()]
-except Exception as e:
-    logging.error(f"Error loading countries.json: {e}")
-    COUNTRIES = []
-
-try:
-    with open("public/countryPackages.json", "r", encoding="utf-8") as f:
-        all_country_packages = json.load(f)
-except Exception as e:
-    logging.error(f"Error loading countryPackages.json: {e}")
-    all_country_packages = []
-
-COUNTRY_CODES_WITH_PACKAGES = set(pkg.get("location") for pkg in all_country_packages)
-
-try:
-    with open("public/regionalPackages.json", "r", encoding="utf-8") as f:
-        all_regional_packages = json.load(f)
-except Exception as e:
-    logging.error(f"Error loading regionalPackages.json: {e}")
-    all_regional_packages = []
-
-try:
-    with open("public/globalPackages.json", "r", encoding="utf-8") as f:
-        all_global_packages = json.load(f)
-except Exception as e:
-    logging.error(f"Error loading globalPackages.json: {e}")
-    all_global_packages = []
-
-# Mapping for region detection (used in the 'buy_regional' flow)
-REGION_ICONS = {
-    "Europe": lambda pkg: "Europe" in pkg.get("name", ""),
-    "South America": lambda pkg: "South America" in pkg.get("name", ""),
-    "North America": lambda pkg: "North America" in pkg.get("name", ""),
-    "Africa": lambda pkg: "Africa" in pkg.get("name", ""),
-    "Asia (excl. China)": lambda pkg: ("Asia" in pkg.get("name", "") or "Singapore" in pkg.get("name", "")),
-    "China": lambda pkg: ("China" in pkg.get("name", "")),
-    "Gulf": lambda pkg: "Gulf" in pkg.get("name", ""),
-    "Middle East": lambda pkg: "Middle East" in pkg.get("name", ""),
-    "Caribbean": lambda pkg: "Caribbean" in pkg.get("name", "")
-}
-
-GLOBAL_PACKAGE_TYPES = {
-    "Global 1GB": 1,
-    "Global 3GB": 3,
-    "Global 5GB": 5,
-    "Global 10GB": 10,
-    "Global 20GB": 20,
-}
+# ====== Package Catalog ======
+# Indexed by package code, location, region and global tier; reloaded in the
+# background when fetch_packages rewrites the files.
+CATALOG_RELOADER = catalog.CatalogReloader()
+REGION_ICONS = catalog.REGION_ICONS
+GLOBAL_PACKAGE_TYPES = catalog.GLOBAL_PACKAGE_TYPES
+COUNTRY_SEARCH_LIMIT = 20
 
 # Create database tables if they don't exist.
 Base.metadata.create_all(bind=engine)
+migrate_schema(engine)
 logging.info("All tables created (if not existing already).")
 
 logging.basicConfig(
@@ -112,16 +70,18 @@ USER_SESSIONS = {}
 # -------------------------------
 # Keyboards & UI
 # -------------------------------
-def build_paginated_keyboard(button_rows, page, rows_per_page=10):
+ROWS_PER_PAGE = 10
+
+def build_paginated_keyboard(button_rows, page, rows_per_page=ROWS_PER_PAGE, callback_prefix="page_"):
     total_pages = (len(button_rows) - 1) // rows_per_page + 1
     start = page * rows_per_page
     end = start + rows_per_page
     current_buttons = button_rows[start:end]
     nav_buttons = []
     if page > 0:
-        nav_buttons.append(InlineKeyboardButton("Previous", callback_data=f"page_{page-1}"))
+        nav_buttons.append(InlineKeyboardButton("Previous", callback_data=f"{callback_prefix}{page-1}"))
     if page < total_pages - 1:
-        nav_buttons.append(InlineKeyboardButton("Next", callback_data=f"page_{page+1}"))
+        nav_buttons.append(InlineKeyboardButton("Next", callback_data=f"{callback_prefix}{page+1}"))
     if nav_buttons:
         current_buttons.append(nav_buttons)
     return InlineKeyboardMarkup(current_buttons)
@@ -143,6 +103,10 @@ def buy_esim_keyboard():
     ]]
     return InlineKeyboardMarkup(keyboard)
 
+def get_catalog() -> catalog.Catalog:
+    """Current catalog snapshot; grab it once per handler and use it throughout."""
+    return CATALOG_RELOADER.current
+
 def country_code_to_emoji(country_code: str) -> str:
     if len(country_code) != 2:
         return ""
@@ -154,8 +118,8 @@ def country_code_to_emoji(country_code: str) -> str:
 # -------------------------------
 async def store_user_in_db(telegram_user):
     """Store or update the Telegram user info in the DB."""
-    def run_db():
-        with SessionLocal() as db:
+    def store():
+        with BotSessionLocal() as db:
             telegram_id = str(telegram_user.id)
             user = db.query(User).filter(User.telegram_id == telegram_id).first()
             username = telegram_user.username or telegram_user.first_name or "Telegram User"
@@ -168,10 +132,35 @@ async def store_user_in_db(telegram_user):
                 logger.info(f"Existing user updated: {telegram_id} - {username}")
             db.commit()
     try:
-        await asyncio.to_thread(run_db)
+        await run_db(store)
     except Exception as e:
         logger.error("Error storing user in DB:", exc_info=e)
 
+def get_order_by_iccid(iccid: str) -> Optional[Order]:
+    """Load the order for an ICCID (runs on the DB thread pool)."""
+    with BotSessionLocal() as session:
+        return session.query(Order).filter(Order.iccid == iccid).first()
+
+def delete_order_by_iccid(iccid: str) -> bool:
+    """Delete the order for an ICCID; False if it does not exist."""
+    with BotSessionLocal() as session:
+        order = session.query(Order).filter(Order.iccid == iccid).first()
+        if not order:
+            return False
+        session.delete(order)
+        session.commit()
+        return True
+
+def save_order_from_api(iccid: str, api_data: dict) -> None:
+    """Persist fresh API data for an ICCID."""
+    with BotSessionLocal() as session:
+        buy_esim.update_order_from_api(session, iccid, api_data)
+
+def save_usage(iccid: str, api_data: dict) -> bool:
+    """Persist fresh usage for an ICCID."""
+    with BotSessionLocal() as session:
+        return buy_esim.update_usage_by_iccid(session, iccid, api_data)
+
 # -------------------------------
 # eSIM Status Label
 # -------------------------------
@@ -236,6 +225,312 @@ def format_esim_info(data: dict, db_entry: Optional[Order] = None) -> str:
         f"🔗 <b>QR:</b> <a href=\"{qr}\">Open Link</a>"
     )
 
+# -------------------------------
+# Package Tables
+# -------------------------------
+LOCAL_TABLE_HEADER = (
+    "```\n"
+    "Volume   | Duration | Price   | Top-Up\n"
+    "---------|----------|---------|-------\n"
+)
+MULTI_TABLE_HEADER = (
+    "```\n"
+    " Vol    Dur    Price  Top-Up  # Countries\n"
+    "-----------------------------------------\n"
+)
+# Views whose keyboards are split into pages (local tables show all packages at once),
+# by the one-letter code used in their page callbacks
+PAGINATED_VIEWS = {"r": "regional", "g": "global"}
+PAGINATED_VIEW_CODES = {view: code for code, view in PAGINATED_VIEWS.items()}
+REGION_BY_KEY = {catalog.region_key(region): region for region in REGION_ICONS}
+
+def package_button_row(pkg: dict) -> list:
+    price = pkg.get("retailPrice", 0) / 10000
+    name = pkg.get("name", "N/A")
+    return [InlineKeyboardButton(
+        f"More Info on {name}   ${price:.2f}",
+        callback_data=f"moreinfo_{pkg.get('packageCode', 'N/A')}"
+    )]
+
+def local_table_row(pkg: dict) -> str:
+    volume_gb = round(pkg.get("volume", 0) / (1024 * 1024 * 1024), 1)
+    duration = pkg.get("duration", "N/A")
+    price = pkg.get("retailPrice", 0) / 10000
+    support = "Yes" if pkg.get("supportTopUpType", 0) == 2 else "No"
+    return f"{volume_gb:>6.1f}GB | {duration:>7}d | ${price:>6.2f} | {support:>5}"
+
+def multi_table_row(pkg: dict) -> str:
+    volume_gb = round(pkg.get("volume", 0) / (1024 * 1024 * 1024), 1)
+    duration_display = f"{pkg.get('duration', 'N/A')}d"
+    price = pkg.get("retailPrice", 0) / 10000
+    support_emoji = "✅" if pkg.get("supportTopUpType", 0) == 2 else "❌"
+    coverage = len(pkg.get("locationNetworkList", []))
+    return (
+        f"{volume_gb:>4.1f}GB| {duration_display:^4}| "
+        f"${price:^7.2f}|{support_emoji:^3}| {coverage:^10}"
+    )
+
+def render_package_table(current_catalog: catalog.Catalog, view: str, key) -> Optional[Tuple[str, list]]:
+    """
+    Table message and "More Info" button rows for one country ("local", ISO code),
+    region ("regional", region name) or global tier ("global", GB). None if it has no packages.
+    """
+    if view == "local":
+        country = current_catalog.countries_by_code.get(key)
+        packages = current_catalog.location_packages(key) if country else []
+        title = f"Available packages for {country_code_to_emoji(key)} {country['name']}:" if country else ""
+        header, render_row = LOCAL_TABLE_HEADER, local_table_row
+    elif view == "regional":
+        packages = current_catalog.region_packages(key)
+        title = f"Available regional packages for {key}:"
+        header, render_row = MULTI_TABLE_HEADER, multi_table_row
+    elif view == "global":
+        packages = current_catalog.global_tier_packages(key)
+        title = f"Available global packages for {key}GB:"
+        header, render_row = MULTI_TABLE_HEADER, multi_table_row
+    else:
+        return None
+    if not packages:
+        return None
+
+    table_body = "\n".join(render_row(pkg) for pkg in packages)
+    text = f"{title}\n\n{header}{table_body}\n```\n\nSelect a package:"
+    return text, [package_button_row(pkg) for pkg in packages]
+
+def page_callback_prefix(current_catalog: catalog.Catalog, view: str, key) -> str:
+    """
+    Page buttons carry everything needed to render the page: "pg|<view>|<key>|<version>|<page>",
+    e.g. "pg|r|asia-excl-china|1a2b3c4d|2" (well under Telegram's 64-byte limit), so paging
+    needs no per-chat state and keeps working after restarts and on any bot instance.
+    """
+    if view == "regional":
+        key = catalog.region_key(key)
+    return f"pg|{PAGINATED_VIEW_CODES[view]}|{key}|{current_catalog.version_tag}|"
+
+def parse_page_callback(args: str) -> Optional[Tuple[str, object, str, int]]:
+    """(view, key, version tag, page) of a page callback's arguments ("<view>|<key>|<version>|<page>"), or None if malformed."""
+    parts = args.split("|")
+    if len(parts) != 4 or parts[0] not in PAGINATED_VIEWS:
+        return None
+    view_code, key, version_tag, page = parts
+    view = PAGINATED_VIEWS[view_code]
+    try:
+        page = int(page)
+        key = REGION_BY_KEY[key] if view == "regional" else int(key)
+    except (KeyError, ValueError):
+        return None
+    return view, key, version_tag, page
+
+class PackageTableCache:
+    """
+    Rendered tables and keyboards of the current catalog, keyed by (view, key, page).
+    Everything is rendered once per catalog version and shared by all chats; the cache
+    starts over when the catalog is reloaded.
+    """
+
+    def __init__(self):
+        self.catalog = None
+        self.tables = {}
+        self.markups = {}
+
+    def get(self, current_catalog: catalog.Catalog, view: str, key, page: int = 0) -> Optional[Tuple[str, InlineKeyboardMarkup]]:
+        if current_catalog is not self.catalog:
+            self.catalog = current_catalog
+            self.tables = {}
+            self.markups = {}
+
+        table = self.tables.get((view, key))
+        if table is None:
+            table = render_package_table(current_catalog, view, key)
+            if table is None:
+                return None
+            self.tables[(view, key)] = table
+        text, button_rows = table
+
+        if view in PAGINATED_VIEW_CODES:
+            # Pages of an older catalog version may no longer exist
+            page = max(0, min(page, (len(button_rows) - 1) // ROWS_PER_PAGE))
+        markup = self.markups.get((view, key, page))
+        if markup is None:
+            if view in PAGINATED_VIEW_CODES:
+                markup = build_paginated_keyboard(
+                    button_rows, page, callback_prefix=page_callback_prefix(current_catalog, view, key)
+                )
+            else:
+                markup = InlineKeyboardMarkup(button_rows)
+            self.markups[(view, key, page)] = markup
+        return text, markup
+
+PACKAGE_TABLES = PackageTableCache()
+
+# -------------------------------
+# My eSIMs Rendering
+# -------------------------------
+def load_user_orders(user_id: str) -> list:
+    """Load the user's orders (one per ICCID) for rendering."""
+    with BotSessionLocal() as session:
+        orders = (
+            session.query(Order)
+            .filter(Order.user_id == user_id, Order.iccid.isnot(None))
+            .order_by(Order.id)
+            .all()
+        )
+    unique = {}
+    for order in orders:
+        unique.setdefault(order.iccid, order)
+    return list(unique.values())
+
+def order_tran_no(order: Order) -> Optional[str]:
+    """esimTranNo of an order: the indexed column, else the first stored eSIM profile."""
+    if order.esim_tran_no:
+        return order.esim_tran_no
+    try:
+        esim_list = json.loads(order.esim_list) if order.esim_list else []
+        return esim_list[0].get("esimTranNo") if esim_list else None
+    except Exception:
+        logger.exception("Failed to parse esim_list:")
+        return None
+
+def order_to_esim_data(order: Order) -> dict:
+    """
+    Build API-shaped eSIM data from a stored Order row, so it can be rendered
+    with format_esim_info before any API call is made.
+    """
+    try:
+        esim_list = json.loads(order.esim_list) if order.esim_list else []
+    except Exception:
+        esim_list = []
+    data = dict(esim_list[0]) if esim_list else {}
+    data["iccid"] = order.iccid
+    if order.qr_code and not data.get("qrCodeUrl"):
+        data["qrCodeUrl"] = order.qr_code
+    if order.esim_status is not None:
+        data["esimStatus"] = order.esim_status
+    if order.smdp_status is not None:
+        data["smdpStatus"] = order.smdp_status
+    if order.order_usage is not None:
+        data["orderUsage"] = order.order_usage
+    if order.total_volume is not None:
+        data["totalVolume"] = order.total_volume
+    if order.expired_time is not None:
+        data["expiredTime"] = order.expired_time.isoformat()
+    return data
+
+def get_esim_priority(data: dict) -> int:
+    """Sort key for the My eSIMs list (higher is shown first)."""
+    status = data.get("esimStatus", "")
+    smdp = data.get("smdpStatus", "")
+    if smdp == "RELEASED" and status == "GOT_RESOURCE":
+        return 0
+    elif smdp == "ENABLED" and status == "IN_USE":
+        return 1
+    elif smdp == "ENABLED" and status == "GOT_RESOURCE":
+        return 2
+    elif status == "USED_UP":
+        return 3
+    elif status == "DELETED":
+        return 4
+    else:
+        return 5
+
+def esim_view_changed(old: dict, new: dict) -> bool:
+    """True if anything shown in the eSIM message differs between two data dicts."""
+    def view(data):
+        return (
+            data.get("esimStatus"),
+            data.get("smdpStatus"),
+            data.get("orderUsage", 0),
+            data.get("totalVolume", 1),
+            (data.get("expiredTime") or "")[:10],
+        )
+    return view(old) != view(new)
+
+def build_esim_keyboard(iccid: str, api_data: dict, db_entry: Optional[Order]) -> Optional[InlineKeyboardMarkup]:
+    """Build the action buttons for an eSIM message."""
+    status_label = get_esim_status_label(
+        api_data.get("smdpStatus", ""),
+        api_data.get("esimStatus", "")
+    )
+    buttons = []
+
+    # 1) "Cancel" if New or Onboard
+    if status_label in ("New", "Onboard"):
+        buttons.append(InlineKeyboardButton(
+            "❌ Cancel", callback_data=f"precancel_{iccid}"
+        ))
+
+    # 2) Possibly show "Top-up" if supported
+    try:
+        esim_list = json.loads(db_entry.esim_list) if db_entry and db_entry.esim_list else []
+        support_topup = esim_list[0].get("supportTopUpType", 0) if esim_list else 0
+        # Allowed statuses for top-up
+        allowed_status = (
+            api_data.get("smdpStatus") in ["RELEASED", "ENABLED"] and
+            api_data.get("esimStatus") in ["GOT_RESOURCE", "IN_USE"]
+        )
+        if support_topup == 2 and allowed_status:
+            buttons.append(InlineKeyboardButton(
+                "➕ Top-up", callback_data=f"topup_{iccid}"
+            ))
+    except Exception as e:
+        logger.warning(f"Failed to parse supportTopUpType or status: {e}")
+
+    # 3) "Refresh" only if In Use
+    if status_label == "In Use":
+        buttons.append(InlineKeyboardButton(
+            "🔄 Refresh Usage", callback_data=f"refresh_{iccid}"
+        ))
+
+    # 4) "Delete" if not in New, Onboard, In Use => i.e. Depleted, Deleted, or fallback
+    if status_label not in ("New", "Onboard", "In Use"):
+        buttons.append(InlineKeyboardButton(
+            "🚮 Delete", callback_data=f"predelete_{iccid}"
+        ))
+
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def revalidate_esim_messages(user_id: str, sent: dict) -> None:
+    """
+    Refresh the user's eSIMs from the API after the stored data has been shown,
+    persist the new usage and edit only the messages whose content changed.
+    `sent` maps ICCID -> (message, data shown, Order).
+    """
+    try:
+        results = await buy_esim.my_esim(user_id, iccids=list(sent))
+    except Exception as e:
+        logger.error("Error refreshing eSIM data:", exc_info=e)
+        return
+
+    fresh = {}
+    for entry in results:
+        if entry["data"] and entry["iccid"] in sent:
+            fresh[entry["iccid"]] = entry["data"]
+        elif entry.get("error"):
+            logger.warning(f"[My eSIMs] Could not refresh ICCID {entry['iccid']}: {entry['error']}")
+
+    # All usage updates for this render go out in one query and one commit
+    def store_usage():
+        with BotSessionLocal() as session:
+            buy_esim.update_usage_bulk(session, fresh)
+    try:
+        await run_db(store_usage)
+    except Exception as e:
+        logger.warning(f"[My eSIMs] Failed to store usage for user {user_id}: {e}")
+
+    for iccid, api_data in fresh.items():
+        message, shown_data, order = sent[iccid]
+        if not esim_view_changed(shown_data, api_data):
+            continue
+        try:
+            await message.edit_text(
+                format_esim_info(api_data, order),
+                parse_mode="HTML",
+                reply_markup=build_esim_keyboard(iccid, api_data, order),
+                disable_web_page_preview=True
+            )
+        except Exception as e:
+            logger.warning(f"[My eSIMs] Failed to update message for ICCID {iccid}: {e}")
+
 # -------------------------------
 # /start Command
 # -------------------------------
@@ -254,6 +549,7 @@ async def start(update: Update, context: CallbackContext) -> None:
 # -------------------------------
 async def handle_message(update: Update, context: CallbackContext) -> None:
     text = update.message.text
+    current_catalog = get_catalog()
 
     # -- 1) Pending Purchase (Quantity Input)
     if "pending_purchase" in context.chat_data:
@@ -299,11 +595,8 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
 
     # -- 2) Awaiting Country Search
     if context.chat_data.get("awaiting_country_search"):
-        query_str = text.lower()
-        matching = [
-            c for c in COUNTRIES
-            if query_str in c["name"].lower() and c["code"] in COUNTRY_CODES_WITH_PACKAGES
-        ]
+        # Ranked: exact name/alias/ISO code, prefixes, substrings, then typo-tolerant matches
+        matching = current_catalog.search_index.search(text, limit=COUNTRY_SEARCH_LIMIT)
         if not matching:
             await update.message.reply_text(
                 "No matching countries with packages found. Please try again."
@@ -355,634 +648,458 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
             reply_markup=buy_esim_keyboard()
         )
     elif text == "🔑 My eSIMs":
-        await update.message.reply_text("🔍 Checking your eSIMs... This may take a few seconds ⏳")
-
+        user_id = str(update.effective_user.id)
         try:
-            esim_data = await buy_esim.my_esim(str(update.effective_user.id))
+            orders = await run_db(load_user_orders, user_id)
         except Exception as e:
-            logger.error("Error fetching eSIM data:", exc_info=e)
+            logger.error("Error loading eSIM orders:", exc_info=e)
             await update.message.reply_text(
                 "❌ Failed to fetch your eSIM data. Please try again later."
             )
             return
 
-        if not esim_data:
+        if not orders:
             await update.message.reply_text("You have no eSIMs yet.")
             return
 
-        # Sort eSIMs by your desired priority (you can also reverse it if needed)
-        def sort_esims_priority(esim_data):
-            def get_priority(entry):
-                status = entry["data"].get("esimStatus", "")
-                smdp = entry["data"].get("smdpStatus", "")
-                if smdp == "RELEASED" and status == "GOT_RESOURCE":
-                    return 0
-                elif smdp == "ENABLED" and status == "IN_USE":
-                    return 1
-                elif smdp == "ENABLED" and status == "GOT_RESOURCE":
-                    return 2
-                elif status == "USED_UP":
-                    return 3
-                elif status == "DELETED":
-                    return 4
-                else:
-                    return 5
-            return sorted(esim_data, key=get_priority, reverse=True)
-
-        esim_data = sort_esims_priority(esim_data)
-
-        # For each eSIM, update usage, format and display info
-        for entry in esim_data:
-            iccid = entry["iccid"]
-            api_data = entry["data"]
-
-            with SessionLocal() as session:
-                db_entry = session.query(Order).filter(Order.iccid == iccid).first()
-                buy_esim.update_usage_by_iccid(session, iccid, api_data)
-                formatted_text = format_esim_info(api_data, db_entry)
-
-            # Determine status label
-            status_label = get_esim_status_label(
-                api_data.get("smdpStatus", ""),
-                api_data.get("esimStatus", "")
-            )
-
-            # Build action buttons
-            buttons = []
-
-            # 1) "Cancel" if New or Onboard
-            if status_label in ("New", "Onboard"):
-                buttons.append(InlineKeyboardButton(
-                    "❌ Cancel", callback_data=f"precancel_{iccid}"
-                ))
-
-            # 2) Possibly show "Top-up" if supported
-            try:
-                esim_list = json.loads(db_entry.esim_list) if db_entry and db_entry.esim_list else []
-                support_topup = esim_list[0].get("supportTopUpType", 0) if esim_list else 0
-                # Allowed statuses for top-up
-                allowed_status = (
-                    api_data.get("smdpStatus") in ["RELEASED", "ENABLED"] and
-                    api_data.get("esimStatus") in ["GOT_RESOURCE", "IN_USE"]
-                )
-                if support_topup == 2 and allowed_status:
-                    buttons.append(InlineKeyboardButton(
-                        "➕ Top-up", callback_data=f"topup_{iccid}"
-                    ))
-            except Exception as e:
-                logger.warning(f"Failed to parse supportTopUpType or status: {e}")
-
-            # 3) "Refresh" only if In Use
-            if status_label == "In Use":
-                buttons.append(InlineKeyboardButton(
-                    "🔄 Refresh Usage", callback_data=f"refresh_{iccid}"
-                ))
-
-            # 4) "Delete" if not in New, Onboard, In Use => i.e. Depleted, Deleted, or fallback
-            if status_label not in ("New", "Onboard", "In Use"):
-                buttons.append(InlineKeyboardButton(
-                    "🚮 Delete", callback_data=f"predelete_{iccid}"
-                ))
-
-            # Send message
-            keyboard_markup = InlineKeyboardMarkup([buttons]) if buttons else None
-            await update.message.reply_text(
-                formatted_text,
+        # Render immediately from the stored orders, then revalidate against the API
+        entries = sorted(
+            ((order, order_to_esim_data(order)) for order in orders),
+            key=lambda entry: get_esim_priority(entry[1]),
+            reverse=True
+        )
+        sent = {}
+        for order, stored_data in entries:
+            message = await update.message.reply_text(
+                format_esim_info(stored_data, order),
                 parse_mode="HTML",
-                reply_markup=keyboard_markup,
+                reply_markup=build_esim_keyboard(order.iccid, stored_data, order),
                 disable_web_page_preview=True
             )
+            sent[order.iccid] = (message, stored_data, order)
+
+        context.application.create_task(revalidate_esim_messages(user_id, sent), update=update)
 
 # -------------------------------
 # Callback Query Handler
 # -------------------------------
+CALLBACKS = CallbackRouter()
+
 async def button_handler(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
     await query.answer()
-    data = query.data
+    await CALLBACKS.dispatch(update, context, query.data)
 
-    if data == "buy_local":
-        await query.message.reply_text("Please enter a country name (or part of it) to search:")
-        context.chat_data["awaiting_country_search"] = True
+@CALLBACKS.exact_route("buy_local")
+async def buy_local(update: Update, context: CallbackContext, _: str) -> None:
+    query = update.callback_query
+    await query.message.reply_text("Please enter a country name (or part of it) to search:")
+    context.chat_data["awaiting_country_search"] = True
 
-    elif data.startswith("local_"):
-        country_code = data.split("_", 1)[1]
-        country = next((c for c in COUNTRIES if c["code"] == country_code), None)
-        if not country:
-            await query.message.reply_text("Country not found in the list.")
-            return
-        country_name = country["name"]
-        country_flag = country_code_to_emoji(country_code)
-        filtered_packages = [pkg for pkg in all_country_packages if pkg.get("location") == country_code]
-        if not filtered_packages:
-            await query.message.reply_text(f"No packages available for {country_flag} {country_name}.")
-            return
-        filtered_packages.sort(key=lambda p: p.get("retailPrice", 0))
+@CALLBACKS.prefix_route("local")
+async def show_local_packages(update: Update, context: CallbackContext, country_code: str) -> None:
+    query = update.callback_query
+    current_catalog = get_catalog()
+    country = current_catalog.countries_by_code.get(country_code)
+    if not country:
+        await query.message.reply_text("Country not found in the list.")
+        return
+    country_name = country["name"]
+    country_flag = country_code_to_emoji(country_code)
+    table = PACKAGE_TABLES.get(current_catalog, "local", country_code)
+    if table is None:
+        await query.message.reply_text(f"No packages available for {country_flag} {country_name}.")
+        return
 
-        table_header = (
-            "```\n"
-            "Volume   | Duration | Price   | Top-Up\n"
-            "---------|----------|---------|-------\n"
-        )
-        table_rows = []
-        keyboard_rows = []
-        for pkg in filtered_packages:
-            volume_gb = round(pkg.get("volume", 0) / (1024 * 1024 * 1024), 1)
-            duration = pkg.get("duration", "N/A")
-            price = pkg.get("retailPrice", 0) / 10000
-            name = pkg.get("name", "N/A")
-            support = "Yes" if pkg.get("supportTopUpType", 0) == 2 else "No"
-            row_str = f"{volume_gb:>6.1f}GB | {duration:>7}d | ${price:>6.2f} | {support:>5}"
-            table_rows.append(row_str)
-            btn_text = f"More Info on {name}   ${price:.2f}"
-            keyboard_rows.append([
-                InlineKeyboardButton(
-                    btn_text,
-                    callback_data=f"moreinfo_{pkg.get('packageCode', 'N/A')}"
-                )
-            ])
-
-        table_body = "\n".join(table_rows)
-        table_footer = "\n```"
-        table_message = (
-            f"Available packages for {country_flag} {country_name}:\n\n"
-            f"{table_header}{table_body}{table_footer}\n\n"
-            "Select a package:"
-        )
-        inline_markup = InlineKeyboardMarkup(keyboard_rows)
-        await query.message.reply_text(
-            table_message,
-            parse_mode="Markdown",
-            reply_markup=inline_markup
-        )
+    table_message, inline_markup = table
+    await query.message.reply_text(
+        table_message,
+        parse_mode="Markdown",
+        reply_markup=inline_markup
+    )
 
-    elif data == "buy_regional":
-        regions = list(REGION_ICONS.keys())
-        num_cols = 3
-        keyboard = [
-            [
-                InlineKeyboardButton(region, callback_data=f"regional_{region}")
-                for region in regions[i:i+num_cols]
-            ]
-            for i in range(0, len(regions), num_cols)
+@CALLBACKS.exact_route("buy_regional")
+async def buy_regional(update: Update, context: CallbackContext, _: str) -> None:
+    query = update.callback_query
+    regions = list(REGION_ICONS.keys())
+    num_cols = 3
+    keyboard = [
+        [
+            InlineKeyboardButton(region, callback_data=f"regional_{region}")
+            for region in regions[i:i+num_cols]
         ]
-        inline_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.reply_text("Select a region:", reply_markup=inline_markup)
+        for i in range(0, len(regions), num_cols)
+    ]
+    inline_markup = InlineKeyboardMarkup(keyboard)
+    await query.message.reply_text("Select a region:", reply_markup=inline_markup)
 
-    elif data.startswith("regional_"):
-        region = data.split("_", 1)[1]
-        if region not in REGION_ICONS:
-            await query.message.reply_text("Region not recognized.")
-            return
-        predicate = REGION_ICONS[region]
-        filtered_packages = [pkg for pkg in all_regional_packages if predicate(pkg)]
-        if not filtered_packages:
-            await query.message.reply_text(f"No regional packages available for {region}.")
-            return
-        filtered_packages.sort(key=lambda p: p.get("retailPrice", 0))
+@CALLBACKS.prefix_route("regional")
+async def show_regional_packages(update: Update, context: CallbackContext, region: str) -> None:
+    query = update.callback_query
+    current_catalog = get_catalog()
+    if region not in REGION_ICONS:
+        await query.message.reply_text("Region not recognized.")
+        return
+    table = PACKAGE_TABLES.get(current_catalog, "regional", region)
+    if table is None:
+        await query.message.reply_text(f"No regional packages available for {region}.")
+        return
 
-        table_header = (
-            "```\n"
-            " Vol    Dur    Price  Top-Up  # Countries\n"
-            "-----------------------------------------\n"
-        )
-        table_rows = []
-        keyboard_rows = []
-        for pkg in filtered_packages:
-            volume_gb = round(pkg.get("volume", 0) / (1024 * 1024 * 1024), 1)
-            duration = pkg.get("duration", "N/A")
-            duration_display = f"{duration}d"
-            price = pkg.get("retailPrice", 0) / 10000
-            name = pkg.get("name", "N/A")
-            support_emoji = "✅" if pkg.get("supportTopUpType", 0) == 2 else "❌"
-            coverage = len(pkg.get("locationNetworkList", []))
-            row_str = (
-                f"{volume_gb:>4.1f}GB| {duration_display:^4}| "
-                f"${price:^7.2f}|{support_emoji:^3}| {coverage:^10}"
-            )
-            table_rows.append(row_str)
-            btn_text = f"More Info on {name}   ${price:.2f}"
-            keyboard_rows.append([
-                InlineKeyboardButton(
-                    btn_text,
-                    callback_data=f"moreinfo_{pkg.get('packageCode', 'N/A')}"
-                )
-            ])
-
-        table_body = "\n".join(table_rows)
-        table_footer = "\n```"
-        full_table_text = (
-            f"Available regional packages for {region}:\n\n"
-            f"{table_header}{table_body}{table_footer}\n\n"
-            "Select a package:"
-        )
-        context.chat_data["current_table_text"] = full_table_text
-        context.chat_data["current_button_rows"] = keyboard_rows
-        context.chat_data["current_page"] = 0
-        initial_markup = build_paginated_keyboard(keyboard_rows, page=0)
-        await query.message.reply_text(
-            full_table_text,
-            parse_mode="Markdown",
-            reply_markup=initial_markup
-        )
+    full_table_text, initial_markup = table
+    await query.message.reply_text(
+        full_table_text,
+        parse_mode="Markdown",
+        reply_markup=initial_markup
+    )
 
-    elif data.startswith("globalcat_"):
-        try:
-            category_value = int(data.split("_", 1)[1])
-        except ValueError:
-            await query.message.reply_text("Invalid category.")
-            return
-        filtered_packages = [
-            pkg for pkg in all_global_packages
-            if int(round(pkg.get("volume", 0) / (1024*1024*1024))) == category_value
-        ]
-        if not filtered_packages:
-            await query.message.reply_text(f"No global packages available for {category_value}GB.")
-            return
-        filtered_packages.sort(key=lambda p: p.get("retailPrice", 0))
+@CALLBACKS.prefix_route("globalcat")
+async def show_global_packages(update: Update, context: CallbackContext, category: str) -> None:
+    query = update.callback_query
+    current_catalog = get_catalog()
+    try:
+        category_value = int(category)
+    except ValueError:
+        await query.message.reply_text("Invalid category.")
+        return
+    table = PACKAGE_TABLES.get(current_catalog, "global", category_value)
+    if table is None:
+        await query.message.reply_text(f"No global packages available for {category_value}GB.")
+        return
 
-        table_header = (
-            "```\n"
-            " Vol    Dur    Price  Top-Up  # Countries\n"
-            "-----------------------------------------\n"
-        )
-        table_rows = []
-        keyboard_rows = []
-        for pkg in filtered_packages:
-            volume_gb = round(pkg.get("volume", 0) / (1024*1024*1024), 1)
-            duration = pkg.get("duration", "N/A")
-            duration_display = f"{duration}d"
-            price = pkg.get("retailPrice", 0) / 10000
-            name = pkg.get("name", "N/A")
-            support_emoji = "✅" if pkg.get("supportTopUpType", 0) == 2 else "❌"
-            coverage = len(pkg.get("locationNetworkList", []))
-            row_str = (
-                f"{volume_gb:>4.1f}GB| {duration_display:^4}| "
-                f"${price:^7.2f}|{support_emoji:^3}| {coverage:^10}"
-            )
-            table_rows.append(row_str)
-            btn_text = f"More Info on {name}   ${price:.2f}"
-            keyboard_rows.append([
-                InlineKeyboardButton(
-                    btn_text,
-                    callback_data=f"moreinfo_{pkg.get('packageCode', 'N/A')}"
-                )
-            ])
-
-        table_body = "\n".join(table_rows)
-        table_footer = "\n```"
-        full_table_text = (
-            f"Available global packages for {category_value}GB:\n\n"
-            f"{table_header}{table_body}{table_footer}\n\n"
-            "Select a package:"
-        )
-        context.chat_data["current_table_text"] = full_table_text
-        context.chat_data["current_button_rows"] = keyboard_rows
-        context.chat_data["current_page"] = 0
-        initial_markup = build_paginated_keyboard(keyboard_rows, page=0)
-        await query.message.reply_text(
-            full_table_text,
-            parse_mode="Markdown",
-            reply_markup=initial_markup
-        )
+    full_table_text, initial_markup = table
+    await query.message.reply_text(
+        full_table_text,
+        parse_mode="Markdown",
+        reply_markup=initial_markup
+    )
 
-    elif data == "buy_global":
-        categories = list(GLOBAL_PACKAGE_TYPES.keys())
-        num_cols = 2
-        keyboard = [
-            [
-                InlineKeyboardButton(cat, callback_data=f"globalcat_{GLOBAL_PACKAGE_TYPES[cat]}")
-                for cat in categories[i:i+num_cols]
-            ]
-            for i in range(0, len(categories), num_cols)
+@CALLBACKS.exact_route("buy_global")
+async def buy_global(update: Update, context: CallbackContext, _: str) -> None:
+    query = update.callback_query
+    categories = list(GLOBAL_PACKAGE_TYPES.keys())
+    num_cols = 2
+    keyboard = [
+        [
+            InlineKeyboardButton(cat, callback_data=f"globalcat_{GLOBAL_PACKAGE_TYPES[cat]}")
+            for cat in categories[i:i+num_cols]
         ]
-        inline_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.reply_text("Select a global package category:", reply_markup=inline_markup)
-
-    elif data.startswith("page_"):
-        page = int(data.split("_", 1)[1])
-        table_text = context.chat_data.get("current_table_text")
-        button_rows = context.chat_data.get("current_button_rows")
-        if table_text and button_rows is not None:
-            new_markup = build_paginated_keyboard(button_rows, page)
-            await query.message.edit_reply_markup(reply_markup=new_markup)
-            context.chat_data["current_page"] = page
-
-    elif data.startswith("moreinfo_"):
-        package_code = data.split("_", 1)[1]
-        pkg = next((p for p in all_country_packages if p.get("packageCode") == package_code), None)
-        if pkg is None:
-            pkg = next((p for p in all_regional_packages if p.get("packageCode") == package_code), None)
-        if pkg is None:
-            pkg = next((p for p in all_global_packages if p.get("packageCode") == package_code), None)
-        if pkg is None:
-            await query.message.reply_text("Package not found.")
-            return
+        for i in range(0, len(categories), num_cols)
+    ]
+    inline_markup = InlineKeyboardMarkup(keyboard)
+    await query.message.reply_text("Select a global package category:", reply_markup=inline_markup)
 
-        volume_gb = round(pkg.get("volume", 0) / (1024 * 1024 * 1024), 1)
-        duration = pkg.get("duration", "N/A")
-        price = pkg.get("retailPrice", 0) / 10000
-        name = pkg.get("name", "N/A")
-        support = "✅" if pkg.get("supportTopUpType", 0) == 2 else "❌"
-        coverage = len(pkg.get("locationNetworkList", []))
-        supported_countries = [
-            ln.get("locationName", "")
-            for ln in pkg.get("locationNetworkList", [])
-        ]
-        supported_countries_str = ", ".join(supported_countries) if supported_countries else "N/A"
-
-        detailed_message = (
-            f"<b>Name:</b> {name}\n"
-            f"<b>Data Volume:</b> {volume_gb}GB\n"
-            f"<b>Duration:</b> {duration} days\n"
-            f"<b>Price:</b> <i><b>${price:.2f}</b></i>\n"
-            f"<b>Top-Up:</b> {support}\n"
-            f"<b>Coverage:</b> {coverage} Countries\n"
-            f"<b>Supported Countries:</b> {supported_countries_str}"
-        )
-        buy_button = InlineKeyboardButton("Buy", callback_data=f"buypkg_{package_code}")
-        keyboard = InlineKeyboardMarkup([[buy_button]])
-        await query.message.reply_text(
-            detailed_message,
-            parse_mode="HTML",
-            reply_markup=keyboard
-        )
+@CALLBACKS.prefix_route("pg")
+async def show_package_page(update: Update, context: CallbackContext, args: str) -> None:
+    query = update.callback_query
+    current_catalog = get_catalog()
+    page_ref = parse_page_callback(args)
+    table = PACKAGE_TABLES.get(current_catalog, page_ref[0], page_ref[1], page_ref[3]) if page_ref else None
+    if table is None:
+        await query.message.reply_text("This list is no longer available, please open it again.")
+        return
+    table_text, markup = table
+    if page_ref[2] == current_catalog.version_tag:
+        await query.message.edit_reply_markup(reply_markup=markup)
+    else:
+        # The catalog changed since this message was sent: show the current table
+        await query.message.edit_text(table_text, parse_mode="Markdown", reply_markup=markup)
 
-    elif data.startswith("buypkg_"):
-        package_code = data.split("_", 1)[1]
-        user_id = str(update.effective_user.id)
-        package = next((p for p in all_country_packages if p.get("packageCode") == package_code), None)
-        if not package:
-            package = next((p for p in all_regional_packages if p.get("packageCode") == package_code), None)
-        if not package:
-            package = next((p for p in all_global_packages if p.get("packageCode") == package_code), None)
-        if not package:
-            await query.message.reply_text("Package not found.")
-            return
+@CALLBACKS.prefix_route("page")
+async def legacy_page(update: Update, context: CallbackContext, _: str) -> None:
+    query = update.callback_query
+    # Page buttons of messages sent before paging became stateless
+    await query.message.reply_text("This list is no longer available, please open it again.")
 
-        duration = package.get("duration", 1)
-        context.chat_data["pending_purchase"] = {
-            "package_code": package_code,
-            "order_price": package.get("price", 0),
-            "retail_price": package.get("retailPrice", 0),
-            "duration": duration
-        }
-        if duration == 1:
-            await query.message.reply_text("🕓 This is a daily plan. How many days do you need?")
-        else:
-            await query.message.reply_text("📱 How many eSIMs would you like to purchase?")
-
-    # -------------------------
-    # Cancel Flow
-    # -------------------------
-    elif data.startswith("precancel_"):
-        iccid = data.split("_", 1)[1]
-        keyboard = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("✅ Yes, cancel", callback_data=f"cancel_{iccid}"),
-                InlineKeyboardButton("❌ No", callback_data="cancel_ignore")
-            ]
-        ])
-        await query.message.reply_text(
-            "⚠️ Are you sure you want to cancel this eSIM?\n"
-            "This action is irreversible and will refund the balance (if eligible).",
-            reply_markup=keyboard
-        )
+@CALLBACKS.prefix_route("moreinfo")
+async def show_package_info(update: Update, context: CallbackContext, package_code: str) -> None:
+    query = update.callback_query
+    current_catalog = get_catalog()
+    pkg = current_catalog.package(package_code)
+    if pkg is None:
+        await query.message.reply_text("Package not found.")
+        return
 
-    elif data == "cancel_ignore":
-        await query.message.reply_text("❎ Cancel request aborted.")
+    volume_gb = round(pkg.get("volume", 0) / (1024 * 1024 * 1024), 1)
+    duration = pkg.get("duration", "N/A")
+    price = pkg.get("retailPrice", 0) / 10000
+    name = pkg.get("name", "N/A")
+    support = "✅" if pkg.get("supportTopUpType", 0) == 2 else "❌"
+    coverage = len(pkg.get("locationNetworkList", []))
+    supported_countries = [
+        ln.get("locationName", "")
+        for ln in pkg.get("locationNetworkList", [])
+    ]
+    supported_countries_str = ", ".join(supported_countries) if supported_countries else "N/A"
+
+    detailed_message = (
+        f"<b>Name:</b> {name}\n"
+        f"<b>Data Volume:</b> {volume_gb}GB\n"
+        f"<b>Duration:</b> {duration} days\n"
+        f"<b>Price:</b> <i><b>${price:.2f}</b></i>\n"
+        f"<b>Top-Up:</b> {support}\n"
+        f"<b>Coverage:</b> {coverage} Countries\n"
+        f"<b>Supported Countries:</b> {supported_countries_str}"
+    )
+    buy_button = InlineKeyboardButton("Buy", callback_data=f"buypkg_{package_code}")
+    keyboard = InlineKeyboardMarkup([[buy_button]])
+    await query.message.reply_text(
+        detailed_message,
+        parse_mode="HTML",
+        reply_markup=keyboard
+    )
 
-    elif data.startswith("cancel_"):
-        iccid = data.split("_", 1)[1]
-        await query.message.reply_text("⏳ Cancelling eSIM...")
+@CALLBACKS.prefix_route("buypkg")
+async def buy_package(update: Update, context: CallbackContext, package_code: str) -> None:
+    query = update.callback_query
+    current_catalog = get_catalog()
+    user_id = str(update.effective_user.id)
+    package = current_catalog.package(package_code)
+    if not package:
+        await query.message.reply_text("Package not found.")
+        return
 
-        with SessionLocal() as session:
-            order = session.query(Order).filter(Order.iccid == iccid).first()
-            if not order:
-                await query.message.reply_text("❌ Order not found.")
-                return
-            logger.info(f"[Cancel] user={update.effective_user.id} requested cancel for ICCID {iccid}")
+    duration = package.get("duration", 1)
+    context.chat_data["pending_purchase"] = {
+        "package_code": package_code,
+        "order_price": package.get("price", 0),
+        "retail_price": package.get("retailPrice", 0),
+        "duration": duration
+    }
+    if duration == 1:
+        await query.message.reply_text("🕓 This is a daily plan. How many days do you need?")
+    else:
+        await query.message.reply_text("📱 How many eSIMs would you like to purchase?")
 
-            # Get current API data
-            esim_data = await buy_esim.query_esim_by_iccid(iccid)
-            smdp = esim_data.get("smdpStatus")
-            esim = esim_data.get("esimStatus")
+# -------------------------
+# Cancel Flow
+# -------------------------
+@CALLBACKS.prefix_route("precancel")
+async def confirm_cancel(update: Update, context: CallbackContext, iccid: str) -> None:
+    query = update.callback_query
+    keyboard = InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("✅ Yes, cancel", callback_data=f"cancel_{iccid}"),
+            InlineKeyboardButton("❌ No", callback_data="cancel_ignore")
+        ]
+    ])
+    await query.message.reply_text(
+        "⚠️ Are you sure you want to cancel this eSIM?\n"
+        "This action is irreversible and will refund the balance (if eligible).",
+        reply_markup=keyboard
+    )
 
-            if smdp != "RELEASED" or esim != "GOT_RESOURCE":
-                await query.message.reply_text(
-                    "❌ This eSIM cannot be cancelled.\n"
-                    "It may already be installed or activated on your device."
-                )
-                return
-            try:
-                esim_list = json.loads(order.esim_list or "[]")
-                tran_no = esim_list[0].get("esimTranNo")
-            except Exception:
-                await query.message.reply_text(
-                    "❌ Failed to extract eSIM transaction number."
-                )
-                return
+@CALLBACKS.exact_route("cancel_ignore")
+async def cancel_ignore(update: Update, context: CallbackContext, _: str) -> None:
+    query = update.callback_query
+    await query.message.reply_text("❎ Cancel request aborted.")
 
-            result = await buy_esim.cancel_esim(tran_no=tran_no)
-            if result.get("success") is True:
-                updated_data = await buy_esim.query_esim_by_iccid(iccid)
-                buy_esim.update_order_from_api(session, iccid, updated_data)
-                await query.message.reply_text(
-                    "✅ eSIM successfully cancelled.\n"
-                    "💸 A refund will be issued shortly."
-                )
-            else:
-                await query.message.reply_text(
-                    "⚠️ The cancellation request is taking longer than expected.\n"
-                    "Please try again in a few minutes or contact support if the issue persists."
-                )
-                logger.error(f"[Cancel API] Timeout or error during cancel for ICCID {iccid}")
-
-    # -------------------------
-    # Delete Flow
-    # -------------------------
-    elif data.startswith("predelete_"):
-        iccid = data.split("_", 1)[1]
-        keyboard = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("✅ Yes, delete", callback_data=f"delete_{iccid}"),
-                InlineKeyboardButton("❌ No", callback_data="delete_ignore")
-            ]
-        ])
-        await query.message.reply_text(
-            "⚠️ Are you sure you want to delete this eSIM from DB?\n"
-            "You will no longer see it in the list, and this action cannot be undone.",
-            reply_markup=keyboard
-        )
+@CALLBACKS.prefix_route("cancel")
+async def cancel_esim(update: Update, context: CallbackContext, iccid: str) -> None:
+    query = update.callback_query
+    await query.message.reply_text("⏳ Cancelling eSIM...")
 
-    elif data == "delete_ignore":
-        await query.message.reply_text("❎ Deletion request aborted.")
+    order = await run_db(get_order_by_iccid, iccid)
+    if not order:
+        await query.message.reply_text("❌ Order not found.")
+        return
+    logger.info(f"[Cancel] user={update.effective_user.id} requested cancel for ICCID {iccid}")
 
-    elif data.startswith("delete_"):
-        iccid = data.split("_", 1)[1]
-        with SessionLocal() as session:
-            order = session.query(Order).filter(Order.iccid == iccid).first()
-            if not order:
-                await query.message.reply_text("❌ eSIM not found in DB.")
-                return
+    # Get current API data
+    esim_data = await buy_esim.query_esim_by_iccid(iccid)
+    smdp = esim_data.get("smdpStatus")
+    esim = esim_data.get("esimStatus")
 
-            logger.info(f"[Delete] user={update.effective_user.id} removing ICCID {iccid} from DB")
-            session.delete(order)
-            session.commit()
+    if smdp != "RELEASED" or esim != "GOT_RESOURCE":
+        await query.message.reply_text(
+            "❌ This eSIM cannot be cancelled.\n"
+            "It may already be installed or activated on your device."
+        )
+        return
+    tran_no = order_tran_no(order)
+    if not tran_no:
         await query.message.reply_text(
-            "✅ eSIM removed from our database. You will no longer see it in your eSIM list."
+            "❌ Failed to extract eSIM transaction number."
         )
+        return
 
-    # -------------------------
-    # Top-Up Flow
-    # -------------------------
-    elif data.startswith("topup_"):
-        iccid = data.split("_", 1)[1]
-        with SessionLocal() as session:
-            order = session.query(Order).filter(Order.iccid == iccid).first()
-        if not order:
-            await query.message.reply_text("❌ eSIM not found in database.")
-            logger.warning(f"[Top-Up] ICCID {iccid} not found in DB.")
-            return
-        try:
-            esim_list = json.loads(order.esim_list) if order.esim_list else []
-            if not esim_list:
-                await query.message.reply_text("❌ No eSIM profiles found.")
-                return
-            esim_tran_no = esim_list[0].get("esimTranNo")
-        except Exception as e:
-            await query.message.reply_text("❌ Failed to extract eSIM transaction number.")
-            logger.exception("Failed to parse esim_list:")
-            return
+    result = await buy_esim.cancel_esim(tran_no=tran_no)
+    if result.get("success") is True:
+        updated_data = await buy_esim.query_esim_by_iccid(iccid)
+        await run_db(save_order_from_api, iccid, updated_data)
+        await query.message.reply_text(
+            "✅ eSIM successfully cancelled.\n"
+            "💸 A refund will be issued shortly."
+        )
+    else:
+        await query.message.reply_text(
+            "⚠️ The cancellation request is taking longer than expected.\n"
+            "Please try again in a few minutes or contact support if the issue persists."
+        )
+        logger.error(f"[Cancel API] Timeout or error during cancel for ICCID {iccid}")
 
-        if not esim_tran_no:
-            await query.message.reply_text("❌ eSIM transaction number is missing.")
-            logger.warning(f"[Top-Up] No esimTranNo found for ICCID {iccid}")
-            return
+# -------------------------
+# Delete Flow
+# -------------------------
+@CALLBACKS.prefix_route("predelete")
+async def confirm_delete(update: Update, context: CallbackContext, iccid: str) -> None:
+    query = update.callback_query
+    keyboard = InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("✅ Yes, delete", callback_data=f"delete_{iccid}"),
+            InlineKeyboardButton("❌ No", callback_data="delete_ignore")
+        ]
+    ])
+    await query.message.reply_text(
+        "⚠️ Are you sure you want to delete this eSIM from DB?\n"
+        "You will no longer see it in the list, and this action cannot be undone.",
+        reply_markup=keyboard
+    )
 
-        packages = await buy_esim.get_topup_packages(iccid)
-        if not packages:
-            await query.message.reply_text("❌ No available Top-Up packages.")
-            return
+@CALLBACKS.exact_route("delete_ignore")
+async def delete_ignore(update: Update, context: CallbackContext, _: str) -> None:
+    query = update.callback_query
+    await query.message.reply_text("❎ Deletion request aborted.")
 
-        packages.sort(key=lambda p: int(p.get("retailPrice", 0)))
-        buttons = []
-        for pkg in packages:
-            name = pkg.get("name", "")
-            retail_price = int(pkg.get("retailPrice", 0)) / 10000
-            pkg_code = pkg["packageCode"]
-            raw_amount = int(pkg.get("price", 0))
-            callback = f"topupdo|{esim_tran_no}|{pkg_code}|{raw_amount}"
-            buttons.append([
-                InlineKeyboardButton(
-                    f"💳 {name} — ${retail_price:.2f}",
-                    callback_data=callback
-                )
-            ])
+@CALLBACKS.prefix_route("delete")
+async def delete_esim(update: Update, context: CallbackContext, iccid: str) -> None:
+    query = update.callback_query
+    deleted = await run_db(delete_order_by_iccid, iccid)
+    if not deleted:
+        await query.message.reply_text("❌ eSIM not found in DB.")
+        return
 
-        await query.message.reply_text(
-            "Choose a top-up package:",
-            reply_markup=InlineKeyboardMarkup(buttons)
-        )
+    logger.info(f"[Delete] user={update.effective_user.id} removed ICCID {iccid} from DB")
+    await query.message.reply_text(
+        "✅ eSIM removed from our database. You will no longer see it in your eSIM list."
+    )
 
-    elif data.startswith("topupdo|"):
-        try:
-            _, tran_no, package_code, amount_str = data.split("|", 3)
-            amount = int(amount_str)
-            await query.message.reply_text("⏳ Please wait, processing your top-up...")
+# -------------------------
+# Top-Up Flow
+# -------------------------
+@CALLBACKS.prefix_route("topup")
+async def choose_topup(update: Update, context: CallbackContext, iccid: str) -> None:
+    query = update.callback_query
+    order = await run_db(get_order_by_iccid, iccid)
+    if not order:
+        await query.message.reply_text("❌ eSIM not found in database.")
+        logger.warning(f"[Top-Up] ICCID {iccid} not found in DB.")
+        return
+    esim_tran_no = order_tran_no(order)
+    if not esim_tran_no:
+        await query.message.reply_text("❌ eSIM transaction number is missing.")
+        logger.warning(f"[Top-Up] No esimTranNo found for ICCID {iccid}")
+        return
+
+    packages = await buy_esim.get_topup_packages(iccid)
+    if not packages:
+        await query.message.reply_text("❌ No available Top-Up packages.")
+        return
 
-            logger.info(f"[Top-Up] user={update.effective_user.id} -> top-up requested: {tran_no}, pkg={package_code}, amount={amount}")
-            result = await buy_esim.topup_esim(tran_no, package_code, amount)
+    packages.sort(key=lambda p: int(p.get("retailPrice", 0)))
+    buttons = []
+    for pkg in packages:
+        name = pkg.get("name", "")
+        retail_price = int(pkg.get("retailPrice", 0)) / 10000
+        pkg_code = pkg["packageCode"]
+        raw_amount = int(pkg.get("price", 0))
+        callback = f"topupdo|{esim_tran_no}|{pkg_code}|{raw_amount}"
+        buttons.append([
+            InlineKeyboardButton(
+                f"💳 {name} — ${retail_price:.2f}",
+                callback_data=callback
+            )
+        ])
+
+    await query.message.reply_text(
+        "Choose a top-up package:",
+        reply_markup=InlineKeyboardMarkup(buttons)
+    )
+
+@CALLBACKS.prefix_route("topupdo")
+async def do_topup(update: Update, context: CallbackContext, args: str) -> None:
+    query = update.callback_query
+    try:
+        tran_no, package_code, amount_str = args.split("|", 2)
+        amount = int(amount_str)
+        await query.message.reply_text("⏳ Please wait, processing your top-up...")
+
+        logger.info(f"[Top-Up] user={update.effective_user.id} -> top-up requested: {tran_no}, pkg={package_code}, amount={amount}")
+        result = await buy_esim.topup_esim(tran_no, package_code, amount)
+
+        if result.get("success") is True:
+            obj = result.get("obj", {})
+            vol = int(obj.get("totalVolume", 0)) / 1024 / 1024
+            dur = obj.get("totalDuration", "-")
+            await query.message.reply_text(
+                f"✅ Top-up successful!\n"
+                f"📦 New data volume: {vol:.1f} MB\n"
+                f"⏳ Valid for: {dur} days"
+            )
 
-            if result.get("success") is True:
-                obj = result.get("obj", {})
-                vol = int(obj.get("totalVolume", 0)) / 1024 / 1024
-                dur = obj.get("totalDuration", "-")
+            iccid = await buy_esim.get_iccid_from_tranno(tran_no)
+            if iccid:
+                try:
+                    api_data = await buy_esim.query_esim_by_iccid(iccid)
+                    await run_db(save_order_from_api, iccid, api_data)
+                except Exception as e:
+                    logger.warning(f"[Top-Up] DB update failed after top-up: {e}")
+        else:
+            err = result.get("errorMessage") or result.get("errorMsg") or "Unknown error"
+            if "status doesn`t support" in err:
                 await query.message.reply_text(
-                    f"✅ Top-up successful!\n"
-                    f"📦 New data volume: {vol:.1f} MB\n"
-                    f"⏳ Valid for: {dur} days"
+                    "❌ Unable to top-up this eSIM: its current status does not allow it.\n\n"
+                    "📌 This usually means the eSIM hasn't been activated on your device yet.\n"
+                    "Top-up is only available after the eSIM has been installed and activated."
                 )
-
-                iccid = await buy_esim.get_iccid_from_tranno(tran_no)
-                if iccid:
-                    with SessionLocal() as session:
-                        try:
-                            api_data = await buy_esim.query_esim_by_iccid(iccid)
-                            buy_esim.update_order_from_api(session, iccid, api_data)
-                        except Exception as e:
-                            logger.warning(f"[Top-Up] DB update failed after top-up: {e}")
             else:
-                err = result.get("errorMessage") or result.get("errorMsg") or "Unknown error"
-                if "status doesn`t support" in err:
-                    await query.message.reply_text(
-                        "❌ Unable to top-up this eSIM: its current status does not allow it.\n\n"
-                        "📌 This usually means the eSIM hasn't been activated on your device yet.\n"
-                        "Top-up is only available after the eSIM has been installed and activated."
-                    )
-                else:
-                    await query.message.reply_text(f"❌ Top-up failed: {err}")
-        except Exception as e:
-            logger.exception("Top-Up execution failed:")
-            await query.message.reply_text("❌ An unexpected error occurred during top-up. Please try again later.")
+                await query.message.reply_text(f"❌ Top-up failed: {err}")
+    except Exception as e:
+        logger.exception("Top-Up execution failed:")
+        await query.message.reply_text("❌ An unexpected error occurred during top-up. Please try again later.")
+
+# -------------------------
+# Refresh Usage Flow
+# -------------------------
+@CALLBACKS.prefix_route("refresh")
+async def refresh_usage(update: Update, context: CallbackContext, iccid: str) -> None:
+    query = update.callback_query
+    try:
+        order = await run_db(get_order_by_iccid, iccid)
+        if not order:
+            await query.message.reply_text("❌ Order not found.")
+            return
+        logger.info(f"[Refresh] user={update.effective_user.id} refreshing usage for ICCID {iccid}")
+        await query.message.reply_text("⏳ Syncing usage data...")
 
-    # -------------------------
-    # Refresh Usage Flow
-    # -------------------------
-    elif data.startswith("refresh_"):
-        try:
-            await query.answer()
-            iccid = data.split("_", 1)[1]
+        # Status and usage both come from the shared profile index
+        api_data = await buy_esim.get_esim_status(iccid)
+        if "error" in api_data:
+            await query.message.reply_text("❌ Failed to fetch usage data.")
+            return
 
-            with SessionLocal() as session:
-                order = session.query(Order).filter(Order.iccid == iccid).first()
-                if not order:
-                    await query.message.reply_text("❌ Order not found.")
-                    return
-                logger.info(f"[Refresh] user={update.effective_user.id} refreshing usage for ICCID {iccid}")
-                await query.message.reply_text("⏳ Syncing usage data...")
+        label = get_esim_status_label(api_data.get("smdpStatus",""), api_data.get("esimStatus",""))
+        if label != "In Use":
+            await query.message.reply_text("⚠️ Usage data is only available for eSIMs in 'In Use' status.")
+            return
 
-                try:
-                    esim_list = json.loads(order.esim_list or "[]")
-                except Exception as e:
-                    logger.warning(f"[Refresh] Failed to parse esim_list: {e}")
-                    await query.message.reply_text("❌ Failed to parse eSIM profile info.")
-                    return
-
-                if not esim_list or not esim_list[0].get("esimTranNo"):
-                    await query.message.reply_text("❌ eSIM profile info is missing.")
-                    return
-
-                tran_no = esim_list[0]["esimTranNo"]
-
-                # Check API data
-                api_data = await buy_esim.query_esim_by_iccid(iccid)
-                label = get_esim_status_label(api_data.get("smdpStatus",""), api_data.get("esimStatus",""))
-                if label != "In Use":
-                    await query.message.reply_text("⚠️ Usage data is only available for eSIMs in 'In Use' status.")
-                    return
-
-                # Query usage
-                usage_info = await buy_esim.query_usage(tran_no)
-                if usage_info:
-                    updated = buy_esim.update_usage_by_iccid(session, iccid, usage_info)
-                    if updated:
-                        refreshed = await buy_esim.query_esim_by_iccid(iccid)
-                        msg = format_esim_info(refreshed, order)
-                        await query.message.reply_text(
-                            msg,
-                            parse_mode="HTML",
-                            disable_web_page_preview=True
-                        )
-                    else:
-                        await query.message.reply_text("⚠️ Usage data received but update failed.")
-                else:
-                    await query.message.reply_text("❌ Failed to fetch usage data.")
-        except Exception as e:
-            logger.exception("Refresh usage failed:")
-            await query.message.reply_text("❌ An unexpected error occurred while refreshing usage.")
-    else:
-        await query.message.reply_text("Unknown action.")
+        updated = await run_db(save_usage, iccid, api_data)
+        if updated:
+            msg = format_esim_info(api_data, order)
+            await query.message.reply_text(
+                msg,
+                parse_mode="HTML",
+                disable_web_page_preview=True
+            )
+        else:
+            await query.message.reply_text("⚠️ Usage data received but update failed.")
+    except Exception as e:
+        logger.exception("Refresh usage failed:")
+        await query.message.reply_text("❌ An unexpected error occurred while refreshing usage.")
+
+@CALLBACKS.fallback_route()
+async def unknown_action(update: Update, context: CallbackContext, _: str) -> None:
+    query = update.callback_query
+    await query.message.reply_text("Unknown action.")
 
 # -------------------------------
 # Error Handling
@@ -996,13 +1113,48 @@ async def handle_message_wrapper(update: Update, context: CallbackContext) -> No
     except Exception as e:
         logger.exception("Error in handle_message:")
 
+# -------------------------------
+# Application Lifecycle
+# -------------------------------
+CALLBACK_METRICS_INTERVAL = int(os.getenv("CALLBACK_METRICS_INTERVAL", "3600"))
+# Connection pools used by this process (handlers and the usage sync)
+BOT_DB_WORKLOADS = ("bot", "sync")
+
+async def log_callback_metrics() -> None:
+    """Periodically log per-action callback counters (calls, errors, avg/max ms) and the DB pools of this process."""
+    while True:
+        await asyncio.sleep(CALLBACK_METRICS_INTERVAL)
+        metrics = CALLBACKS.metrics()
+        if metrics:
+            logger.info(f"[Callbacks] {json.dumps(metrics)}")
+        logger.info(f"[DB Pools] {json.dumps(pool_metrics(BOT_DB_WORKLOADS))}")
+
+async def on_startup(application: Application) -> None:
+    await buy_esim.start_http_session()
+    application.bot_data["usage_sync_task"] = asyncio.create_task(buy_esim.usage_sync_worker())
+    application.bot_data["catalog_reload_task"] = asyncio.create_task(CATALOG_RELOADER.watch())
+    application.bot_data["callback_metrics_task"] = asyncio.create_task(log_callback_metrics())
+
+async def on_shutdown(application: Application) -> None:
+    for task_name in ("usage_sync_task", "catalog_reload_task", "callback_metrics_task"):
+        task = application.bot_data.pop(task_name, None)
+        if task:
+            task.cancel()
+    await buy_esim.close_http_session()
+
 # -------------------------------
 # App Entry Point
 # -------------------------------
 if __name__ == "__main__":
     if sys.platform == "win32":
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message_wrapper))
@@ -5,7 +5,8 @@ This module interacts with the ESIMAccess API using asynchronous HTTP calls via
 It handles processes such as balance checking, order placement, profile querying (including polling),
 and related operations (e.g. top-up and cancellation).
 
-All database operations use context managers for safe session management.
+All database operations use context managers for safe session management and are
+run on the dedicated DB thread pool (database.run_db) so they never block the event loop.
 """
 
 import os
@@ -13,12 +14,16 @@ import asyncio
 import uuid
 import logging
 import json
+import time
+import weakref
 import aiohttp
+from collections import OrderedDict
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Dict, Any, AsyncIterator, Awaitable, Callable, Set
 
+from sqlalchemy import case, or_
 from sqlalchemy.orm import Session
-from database import SessionLocal
+from database import BotSessionLocal, SyncSessionLocal, run_db
 from models import Order
 
 # Configure logger
@@ -34,18 +39,93 @@ API_HEADERS = {
 }
 
 
+# HTTP connection pool settings (overridable from the environment)
+HTTP_POOL_LIMIT = int(os.getenv("ESIM_HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("ESIM_HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("ESIM_HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("ESIM_HTTP_DNS_CACHE_TTL", "300"))
+
+# Fan-out limits for per-user eSIM status lookups
+MY_ESIM_CONCURRENCY = int(os.getenv("MY_ESIM_CONCURRENCY", "5"))
+MY_ESIM_LOOKUP_TIMEOUT = float(os.getenv("MY_ESIM_LOOKUP_TIMEOUT", "15"))
+
+# Paged /esim/query settings for the shared profile index
+ESIM_QUERY_PAGE_SIZE = int(os.getenv("ESIM_QUERY_PAGE_SIZE", "100"))
+PROFILE_INDEX_TTL = float(os.getenv("PROFILE_INDEX_TTL", "30"))
+
+# Per-ICCID status cache
+ESIM_STATUS_CACHE_TTL = float(os.getenv("ESIM_STATUS_CACHE_TTL", "10"))
+ESIM_STATUS_CACHE_SIZE = int(os.getenv("ESIM_STATUS_CACHE_SIZE", "1024"))
+
+# Background usage sync
+USAGE_SYNC_INTERVAL = float(os.getenv("USAGE_SYNC_INTERVAL", "600"))
+USAGE_SYNC_BATCH_SIZE = int(os.getenv("USAGE_SYNC_BATCH_SIZE", "100"))
+TERMINAL_ESIM_STATUSES = ("USED_UP", "DELETED")
+
+# One session per event loop: aiohttp sessions are bound to the loop they were created on,
+# and the server and the support bot thread run their own loops in the same process.
+_http_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = weakref.WeakKeyDictionary()
+
+
+async def start_http_session() -> aiohttp.ClientSession:
+    """
+    Create the shared aiohttp session of the running event loop, used for every ESIMAccess call.
+    Call on application startup; safe to call more than once.
+    """
+    loop = asyncio.get_running_loop()
+    session = _http_sessions.get(loop)
+    if session is not None and not session.closed:
+        return session
+
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        use_dns_cache=True,
+    )
+    session = _http_sessions[loop] = aiohttp.ClientSession(connector=connector, headers=API_HEADERS)
+    logger.info(
+        f"[HTTP] Session started (limit={HTTP_POOL_LIMIT}, per_host={HTTP_POOL_LIMIT_PER_HOST}, "
+        f"keepalive={HTTP_KEEPALIVE_TIMEOUT}s, dns_ttl={HTTP_DNS_CACHE_TTL}s)"
+    )
+    return session
+
+
+async def close_http_session() -> None:
+    """
+    Close the running event loop's session. Call on application shutdown.
+    """
+    session = _http_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+        logger.info("[HTTP] Session closed")
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """
+    Return the running event loop's session, creating it lazily if startup did not run.
+    """
+    session = _http_sessions.get(asyncio.get_running_loop())
+    if session is None or session.closed:
+        return await start_http_session()
+    return session
+
+
 async def api_post(url: str, payload: dict, timeout: int = 30, retries: int = 3, backoff_factor: float = 1.0) -> dict:
     """
     Helper function to send POST requests to the API asynchronously using aiohttp.
-    Implements a simple retry mechanism with exponential backoff.
+    Reuses pooled keep-alive connections from the shared session and
+    implements a simple retry mechanism with exponential backoff.
     """
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
     for attempt in range(retries):
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload, headers=API_HEADERS, timeout=timeout) as response:
-                    response.raise_for_status()
-                    data = await response.json()
-                    return data
+            session = await get_http_session()
+            async with session.post(url, json=payload, timeout=client_timeout) as response:
+                response.raise_for_status()
+                data = await response.json()
+                return data
         except Exception as e:
             logger.warning(f"[API POST] Attempt {attempt+1} for URL {url} failed: {e}")
             if attempt < retries - 1:
@@ -170,6 +250,62 @@ async def poll_profile(order_no: str, timeout: int = 30, interval: int = 5) -> d
 # -----------------------------
 # 4. Process Purchase
 # -----------------------------
+def _save_purchased_orders(
+    esim_list_raw: List[dict],
+    user_id: str,
+    package_code: str,
+    order_no: str,
+    transaction_id: str,
+    period_num: Optional[int],
+    order_price: int,
+    retail_price: int
+) -> List[str]:
+    """
+    Store one Order row per allocated profile and return their QR codes.
+    Runs on the DB thread pool.
+    """
+    orders_created = []
+    # Use a context manager for DB session to ensure safe commit/rollback.
+    with BotSessionLocal() as session:
+        for profile in esim_list_raw:
+            iccid_value = profile.get("iccid")
+            qr_code = profile.get("qrCodeUrl")
+            if not iccid_value or not qr_code:
+                continue
+
+            new_order = Order(
+                user_id=user_id,
+                package_code=package_code,
+                order_id=order_no,
+                transaction_id=transaction_id,
+                iccid=iccid_value,
+                esim_tran_no=profile.get("esimTranNo"),
+                count=1,
+                period_num=period_num,
+                price=order_price,
+                retail_price=retail_price,
+                qr_code=qr_code,
+                status="confirmed",
+                details=None,
+                esim_status=profile.get("esimStatus"),
+                smdp_status=profile.get("smdpStatus"),
+                expired_time=profile.get("expiredTime"),
+                total_volume=profile.get("totalVolume"),
+                total_duration=profile.get("totalDuration"),
+                order_usage=profile.get("orderUsage"),
+                esim_list=json.dumps([profile]),
+                package_list=json.dumps(profile.get("packageList"))
+            )
+            session.add(new_order)
+            orders_created.append(qr_code)
+        try:
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise Exception(f"Database error: {str(e)}")
+    return orders_created
+
+
 async def process_purchase(
     package_code: str, 
     user_id: str, 
@@ -216,44 +352,17 @@ async def process_purchase(
     if not qr_codes:
         raise Exception("No QR codes found in the response.")
 
-    orders_created = []
-    # Use a context manager for DB session to ensure safe commit/rollback.
-    with SessionLocal() as session:
-        for profile in esim_list_raw:
-            iccid_value = profile.get("iccid")
-            qr_code = profile.get("qrCodeUrl")
-            if not iccid_value or not qr_code:
-                continue
-
-            new_order = Order(
-                user_id=user_id,
-                package_code=package_code,
-                order_id=order_no,
-                transaction_id=transaction_id,
-                iccid=iccid_value,
-                count=1,
-                period_num=period_num,
-                price=order_price,
-                retail_price=retail_price,
-                qr_code=qr_code,
-                status="confirmed",
-                details=None,
-                esim_status=profile.get("esimStatus"),
-                smdp_status=profile.get("smdpStatus"),
-                expired_time=profile.get("expiredTime"),
-                total_volume=profile.get("totalVolume"),
-                total_duration=profile.get("totalDuration"),
-                order_usage=profile.get("orderUsage"),
-                esim_list=json.dumps([profile]),
-                package_list=json.dumps(profile.get("packageList"))
-            )
-            session.add(new_order)
-            orders_created.append(qr_code)
-        try:
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            raise Exception(f"Database error: {str(e)}")
+    orders_created = await run_db(
+        _save_purchased_orders,
+        esim_list_raw,
+        user_id=user_id,
+        package_code=package_code,
+        order_no=order_no,
+        transaction_id=transaction_id,
+        period_num=period_num,
+        order_price=order_price,
+        retail_price=retail_price
+    )
 
     return {"orderNo": order_no, "qrCodes": orders_created, "status": "confirmed"}
 
@@ -261,10 +370,99 @@ async def process_purchase(
 # -----------------------------
 # 5. Query eSIM Status by ICCID
 # -----------------------------
-async def query_esim_by_iccid(iccid: str) -> dict:
+class _FetchAbandoned(Exception):
+    """Set on an in-flight fetch whose caller was cancelled; waiters then fetch themselves."""
+
+
+class AsyncTTLCache:
     """
-    Query the status of an eSIM using its ICCID.
+    Small in-process async cache.
+
+    Entries expire after `ttl` seconds and the least recently used entry is evicted
+    once `maxsize` is exceeded. Concurrent misses for the same key share a single
+    in-flight fetch (single-flight). If the caller running that fetch is cancelled, the
+    other callers are not: the next one starts a new fetch. Hit/miss/coalesced counters
+    are kept for monitoring.
     """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_fetch(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[Any]],
+        cacheable: Callable[[Any], bool] = lambda value: True
+    ) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        while True:
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except _FetchAbandoned:
+                continue
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:
+            # Only this caller was cancelled; waiters retry instead of seeing CancelledError
+            future.set_exception(_FetchAbandoned())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark as retrieved when nobody else was waiting
+            raise
+        else:
+            future.set_result(value)
+            # Skip storing if the key was invalidated while the fetch was running
+            if self._inflight.get(key) is future and cacheable(value):
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            return value
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def invalidate(self, key: str) -> None:
+        self._entries.pop(key, None)
+        self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "size": len(self._entries),
+        }
+
+
+esim_status_cache = AsyncTTLCache(ttl=ESIM_STATUS_CACHE_TTL, maxsize=ESIM_STATUS_CACHE_SIZE)
+
+
+async def _query_esim_by_iccid(iccid: str) -> dict:
     url = f"{BASE_URL}/esim/query"
     payload = {
         "orderNo": "",
@@ -281,6 +479,30 @@ async def query_esim_by_iccid(iccid: str) -> dict:
         return {"error": str(e)}
 
 
+async def query_esim_by_iccid(iccid: str) -> dict:
+    """
+    Query the status of an eSIM using its ICCID.
+    Successful results are cached for ESIM_STATUS_CACHE_TTL seconds and concurrent
+    queries for the same ICCID share one API call; errors are never cached.
+    """
+    return await esim_status_cache.get_or_fetch(
+        iccid,
+        lambda: _query_esim_by_iccid(iccid),
+        cacheable=lambda data: "error" not in data
+    )
+
+
+async def invalidate_esim_status(iccid: Optional[str] = None, tran_no: Optional[str] = None) -> None:
+    """
+    Forget cached status for an eSIM whose state just changed (cancel, top-up).
+    """
+    if not iccid and tran_no:
+        iccid = await get_iccid_from_tranno(tran_no)
+    if iccid:
+        esim_status_cache.invalidate(iccid)
+        profile_index.discard(iccid)
+
+
 async def fetch_esim_with_retry(iccid: str, retries: int = 3, delay: int = 1) -> Optional[dict]:
     """
     Retry querying the eSIM by ICCID if necessary.
@@ -295,20 +517,66 @@ async def fetch_esim_with_retry(iccid: str, retries: int = 3, delay: int = 1) ->
     return None
 
 
-async def my_esim(user_id: str) -> list:
+async def _fetch_esim_entry(iccid: str, semaphore: asyncio.Semaphore, timeout: float) -> dict:
     """
-    Retrieve the list of eSIMs associated with a user, updating their status from the API.
+    Fetch a single ICCID under the shared semaphore, turning timeouts and
+    failures into a per-ICCID error instead of raising.
     """
-    with SessionLocal() as session:
+    async with semaphore:
+        try:
+            data = await asyncio.wait_for(fetch_esim_with_retry(iccid), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"[my_esim] Lookup timed out after {timeout}s for ICCID {iccid}")
+            return {"iccid": iccid, "data": None, "error": "Timed out fetching eSIM status."}
+        except Exception as e:
+            logger.warning(f"[my_esim] Lookup failed for ICCID {iccid}: {e}")
+            return {"iccid": iccid, "data": None, "error": str(e)}
+    if data is None:
+        return {"iccid": iccid, "data": None, "error": "No eSIM data returned."}
+    return {"iccid": iccid, "data": data, "error": None}
+
+
+def _load_user_iccids(user_id: str) -> List[str]:
+    with BotSessionLocal() as session:
         iccid_tuples = session.query(Order.iccid).filter(Order.user_id == user_id).distinct().all()
-    results = []
-    for iccid_tuple in iccid_tuples:
-        iccid = iccid_tuple[0]
-        if iccid:
-            logger.debug(f"[my_esim] Fetching API status for ICCID {iccid}")
-            data = await fetch_esim_with_retry(iccid)
-            results.append({"iccid": iccid, "data": data})
-    return results
+    return [iccid_tuple[0] for iccid_tuple in iccid_tuples if iccid_tuple[0]]
+
+
+async def my_esim(user_id: str, iccids: Optional[List[str]] = None) -> list:
+    """
+    Retrieve the list of eSIMs associated with a user, updating their status from the API.
+
+    Statuses come from the shared ProfileIndex when possible; ICCIDs missing from it are
+    looked up concurrently (at most MY_ESIM_CONCURRENCY at a time, each bounded by
+    MY_ESIM_LOOKUP_TIMEOUT seconds). Results keep the DB order; an entry whose lookup
+    failed has "data" set to None and the reason in "error".
+    Pass `iccids` when the caller already loaded the user's orders to skip the DB read.
+    """
+    if iccids is None:
+        iccids = await run_db(_load_user_iccids, user_id)
+    if not iccids:
+        return []
+
+    # Serve what we can from the shared paged index; only unindexed ICCIDs
+    # fall back to one query each.
+    indexed = {}
+    if await profile_index.refresh():
+        indexed = {iccid: profile_index.by_iccid[iccid] for iccid in iccids if iccid in profile_index.by_iccid}
+    missing = [iccid for iccid in iccids if iccid not in indexed]
+
+    fetched = {}
+    if missing:
+        logger.debug(f"[my_esim] Fetching API status for {len(missing)} unindexed ICCIDs")
+        semaphore = asyncio.Semaphore(MY_ESIM_CONCURRENCY)
+        entries = await asyncio.gather(
+            *(_fetch_esim_entry(iccid, semaphore, MY_ESIM_LOOKUP_TIMEOUT) for iccid in missing)
+        )
+        fetched = {entry["iccid"]: entry for entry in entries}
+
+    return [
+        {"iccid": iccid, "data": indexed[iccid], "error": None} if iccid in indexed else fetched[iccid]
+        for iccid in iccids
+    ]
 
 
 # -----------------------------
@@ -323,10 +591,12 @@ async def cancel_esim(iccid: str = None, tran_no: str = None) -> dict:
     payload = {"iccid": iccid} if iccid else {"esimTranNo": tran_no}
     url = f"{BASE_URL}/esim/cancel"
     try:
-        return await api_post(url, payload, timeout=15)
+        result = await api_post(url, payload, timeout=15)
     except Exception as e:
         logger.warning(f"[Cancel API] Failed: {e}")
         return {"success": False, "errorMessage": str(e)}
+    await invalidate_esim_status(iccid=iccid, tran_no=tran_no)
+    return result
 
 
 # -----------------------------
@@ -367,15 +637,27 @@ async def topup_esim(esim_tran_no: str, package_code: str, amount: int) -> dict:
     logger.info(f"[Top-Up API] Top-Up requested: tranNo={esim_tran_no}, package={package_code}, amount={amount}, txn_id={txn_id}")
     url = f"{BASE_URL}/esim/topup"
     try:
-        return await api_post(url, payload, timeout=15)
+        result = await api_post(url, payload, timeout=15)
     except Exception as e:
         logger.warning(f"[Top-Up API] Failed: {e}")
         return {"success": False, "errorMessage": str(e)}
+    await invalidate_esim_status(tran_no=esim_tran_no)
+    return result
 
 
 # -----------------------------
 # 9. Update Usage and Order Data
 # -----------------------------
+def _apply_usage_fields(order: Order, data: dict) -> None:
+    """
+    Copy usage and status from API profile data onto an Order: the same fields the
+    background usage sync writes (see _usage_mapping), so both paths stay in step.
+    """
+    for field, value in _usage_mapping(order.id, data).items():
+        if field != "id":
+            setattr(order, field, value)
+
+
 def update_usage_by_iccid(db: Session, iccid: str, data: dict) -> bool:
     """
     Update an Order record's usage information in the database.
@@ -385,22 +667,27 @@ def update_usage_by_iccid(db: Session, iccid: str, data: dict) -> bool:
         logger.warning(f"[Usage Sync] Order not found for ICCID {iccid}")
         return False
 
-    if "orderUsage" in data:
-        order.order_usage = data["orderUsage"]
-
-    if "lastUpdateTime" in data:
-        try:
-            order.last_update_time = datetime.fromisoformat(data["lastUpdateTime"])
-        except Exception as e:
-            logger.warning(f"[Usage Sync] Failed to parse lastUpdateTime for ICCID {iccid}: {e}")
-            order.last_update_time = None
-
-    order.updated_at = datetime.utcnow()
+    _apply_usage_fields(order, data)
     db.commit()
     logger.info(f"[Usage Sync] Updated usage for ICCID {iccid} — {order.order_usage / 1024 / 1024:.1f} MB used")
     return True
 
 
+def update_usage_bulk(db: Session, usage_by_iccid: Dict[str, dict]) -> int:
+    """
+    Update usage and status for several ICCIDs with a single SELECT ... IN (...) and a single commit.
+    Returns the number of orders updated.
+    """
+    if not usage_by_iccid:
+        return 0
+    orders = db.query(Order).filter(Order.iccid.in_(list(usage_by_iccid))).all()
+    for order in orders:
+        _apply_usage_fields(order, usage_by_iccid[order.iccid])
+    db.commit()
+    logger.info(f"[Usage Sync] Updated usage for {len(orders)} orders")
+    return len(orders)
+
+
 def update_order_from_api(session: Session, iccid: str, data: dict) -> None:
     """
     Update an Order record in the database with the latest API data.
@@ -426,6 +713,7 @@ def update_order_fields(order: Order, api_data: dict):
         order.order_usage = api_data.get("orderUsage", order.order_usage)
         order.esim_status = api_data.get("esimStatus", order.esim_status)
         order.smdp_status = api_data.get("smdpStatus", order.smdp_status)
+        order.esim_tran_no = api_data.get("esimTranNo", order.esim_tran_no)
 
         # Update last sync time from API
         if "lastUpdateTime" in api_data:
@@ -440,30 +728,347 @@ def update_order_fields(order: Order, api_data: dict):
 
 
 # -----------------------------
-# 10. Lookup ICCID from Transaction Number
+# 10. Allocated Profiles (paged) and Lookup Index
 # -----------------------------
-async def query_allocated_profiles() -> List[dict]:
+def _extract_esim_list(response: dict) -> List[dict]:
+    """
+    Pull the eSIM profiles out of an /esim/query response, whether 'obj' is a dict
+    with an 'esimList' or a list of such dicts / profiles.
+    """
+    obj_data = response.get("obj") if isinstance(response, dict) else None
+    if isinstance(obj_data, dict):
+        return obj_data.get("esimList") or []
+    esim_list = []
+    if isinstance(obj_data, list):
+        for item in obj_data:
+            if isinstance(item, dict) and "esimList" in item:
+                esim_list.extend(item["esimList"] or [])
+            elif isinstance(item, dict) and "iccid" in item:
+                esim_list.append(item)
+    return esim_list
+
+
+class ProfileQueryError(Exception):
+    """An /esim/query page returned an unsuccessful response."""
+
+
+async def iter_allocated_profile_pages(page_size: int = ESIM_QUERY_PAGE_SIZE, **filters) -> AsyncIterator[List[dict]]:
     """
-    Query the API to retrieve allocated profiles.
-    This version assumes an empty payload.
+    Stream allocated profiles from /esim/query one page at a time.
+    Extra keyword arguments (e.g. orderNo, iccid, esimTranNo) are sent as query filters.
+    Stops after the last page or on an empty page; raises ProfileQueryError when any page
+    is unsuccessful, so callers never take a failed or partial listing for the complete one.
     """
     url = f"{BASE_URL}/esim/query"
-    payload = {}
-    try:
+    page_num = 1
+    fetched = 0
+    while True:
+        payload = {"orderNo": "", **filters, "pager": {"pageNum": page_num, "pageSize": page_size}}
         data = await api_post(url, payload, timeout=30)
-        if data.get("success") and isinstance(data.get("obj"), list):
-            return data["obj"]
+        if not data.get("success"):
+            raise ProfileQueryError(f"Page {page_num} failed after {fetched} profiles: {data.get('errorMsg')}")
+        page = _extract_esim_list(data)
+        if not page:
+            return
+        yield page
+
+        fetched += len(page)
+        obj_data = data.get("obj")
+        total = obj_data.get("pager", {}).get("total") if isinstance(obj_data, dict) else None
+        if len(page) < page_size or (total is not None and fetched >= total):
+            return
+        page_num += 1
+
+
+async def query_allocated_profiles() -> List[dict]:
+    """
+    Query the API to retrieve all allocated profiles, walking every page.
+    Returns an empty list if a page fails part-way.
+    """
+    profiles = []
+    try:
+        async for page in iter_allocated_profile_pages():
+            profiles.extend(page)
     except Exception as e:
         logger.warning(f"[Query Profiles] Failed to fetch allocated profiles: {e}")
-    return []
+        return []
+    return profiles
+
+
+class ProfileIndex:
+    """
+    In-memory index of all allocated profiles, keyed by ICCID and by esimTranNo.
+
+    Rebuilt from a paged /esim/query walk at most once per `max_age` seconds;
+    concurrent callers wait for the same rebuild instead of starting their own.
+    """
+
+    def __init__(self):
+        self.by_iccid: Dict[str, dict] = {}
+        self.by_tranno: Dict[str, dict] = {}
+        self.loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    def is_fresh(self, max_age: float) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at <= max_age
+
+    async def refresh(self, max_age: float = PROFILE_INDEX_TTL) -> bool:
+        """
+        Make sure the index is at most `max_age` seconds old.
+        Returns False if it could not be rebuilt (the previous index is kept).
+        """
+        if self.is_fresh(max_age):
+            return True
+        async with self._lock:
+            if self.is_fresh(max_age):
+                return True
+            by_iccid, by_tranno = {}, {}
+            pages = 0
+            try:
+                async for page in iter_allocated_profile_pages():
+                    pages += 1
+                    for profile in page:
+                        if profile.get("iccid"):
+                            by_iccid[profile["iccid"]] = profile
+                        if profile.get("esimTranNo"):
+                            by_tranno[profile["esimTranNo"]] = profile
+            except Exception as e:
+                logger.warning(f"[Profile Index] Rebuild failed after {pages} pages: {e}")
+                return False
+            self.by_iccid, self.by_tranno = by_iccid, by_tranno
+            self.loaded_at = time.monotonic()
+            logger.info(f"[Profile Index] Indexed {len(by_iccid)} profiles from {pages} pages")
+            return True
+
+    def discard(self, iccid: str) -> None:
+        """
+        Drop a profile whose state is known to have changed (e.g. after cancel/top-up).
+        """
+        profile = self.by_iccid.pop(iccid, None)
+        if profile and profile.get("esimTranNo"):
+            self.by_tranno.pop(profile["esimTranNo"], None)
+
+
+profile_index = ProfileIndex()
+
+
+async def get_esim_status(iccid: str, max_age: float = PROFILE_INDEX_TTL) -> dict:
+    """
+    Return the status of an eSIM from the shared profile index,
+    falling back to a single-ICCID query if it is not indexed.
+    """
+    if await profile_index.refresh(max_age):
+        profile = profile_index.by_iccid.get(iccid)
+        if profile:
+            return profile
+    return await query_esim_by_iccid(iccid)
+
+
+# Orders the backfill could not match, so later runs in this process do not parse them again
+_backfill_unmatched: Set[int] = set()
+
+
+def backfill_esim_tran_nos(profiles_by_iccid: Optional[Dict[str, dict]] = None) -> int:
+    """
+    Fill Order.esim_tran_no for rows that do not have it yet, using the stored
+    esim_list snapshot or, failing that, profiles keyed by ICCID (e.g. the profile index).
+    Runs once per process from the usage sync worker; only id, iccid and esim_list are loaded.
+    """
+    profiles_by_iccid = profiles_by_iccid or {}
+    mappings = []
+    with SyncSessionLocal() as session:
+        rows = (
+            session.query(Order.id, Order.iccid, Order.esim_list)
+            .filter(Order.esim_tran_no.is_(None), Order.iccid.isnot(None))
+            .all()
+        )
+        for order_id, iccid, esim_list_json in rows:
+            if order_id in _backfill_unmatched:
+                continue
+            tran_no = None
+            try:
+                esim_list = json.loads(esim_list_json) if esim_list_json else []
+                tran_no = esim_list[0].get("esimTranNo") if esim_list else None
+            except Exception:
+                pass
+            if not tran_no and iccid in profiles_by_iccid:
+                tran_no = profiles_by_iccid[iccid].get("esimTranNo")
+            if tran_no:
+                mappings.append({"id": order_id, "esim_tran_no": tran_no})
+            else:
+                _backfill_unmatched.add(order_id)
+        if mappings:
+            session.bulk_update_mappings(Order, mappings)
+            session.commit()
+            logger.info(f"[DB Sync] Backfilled esimTranNo for {len(mappings)} orders")
+    return len(mappings)
+
+
+def _lookup_iccid_by_tranno(tran_no: str) -> Optional[str]:
+    with BotSessionLocal() as session:
+        row = (
+            session.query(Order.iccid)
+            .filter(Order.esim_tran_no == tran_no, Order.iccid.isnot(None))
+            .first()
+        )
+    return row[0] if row else None
+
+
+def _store_tranno(tran_no: str, iccid: str) -> None:
+    with BotSessionLocal() as session:
+        session.query(Order).filter(Order.iccid == iccid, Order.esim_tran_no.is_(None)).update(
+            {Order.esim_tran_no: tran_no}, synchronize_session=False
+        )
+        session.commit()
 
 
 async def get_iccid_from_tranno(tran_no: str) -> Optional[str]:
     """
     Retrieve the ICCID corresponding to a given transaction number.
+
+    Uses the indexed orders.esim_tran_no column first. On a miss, checks the
+    already-loaded profile index and then walks /esim/query page by page,
+    stopping at the first match; the result is written back to the DB.
     """
-    profiles = await query_allocated_profiles()
-    for profile in profiles:
-        if profile.get("esimTranNo") == tran_no:
-            return profile.get("iccid")
-    return None
+    iccid = await run_db(_lookup_iccid_by_tranno, tran_no)
+    if iccid:
+        return iccid
+
+    profile = profile_index.by_tranno.get(tran_no)
+    if not profile:
+        try:
+            async for page in iter_allocated_profile_pages():
+                profile = next((p for p in page if p.get("esimTranNo") == tran_no), None)
+                if profile:
+                    break
+        except Exception as e:
+            logger.warning(f"[Query Profiles] Lookup of tranNo {tran_no} failed: {e}")
+            return None
+
+    iccid = profile.get("iccid") if profile else None
+    if iccid:
+        try:
+            await run_db(_store_tranno, tran_no, iccid)
+        except Exception as e:
+            logger.warning(f"[DB Sync] Failed to store tranNo {tran_no} for ICCID {iccid}: {e}")
+    return iccid
+
+
+# -----------------------------
+# 11. Background Usage Sync
+# -----------------------------
+def _parse_api_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _load_active_orders() -> List[tuple]:
+    """
+    Return (id, iccid) for every order that can still change, IN_USE eSIMs first.
+    """
+    with SyncSessionLocal() as session:
+        return (
+            session.query(Order.id, Order.iccid)
+            .filter(
+                Order.iccid.isnot(None),
+                or_(Order.esim_status.is_(None), Order.esim_status.notin_(TERMINAL_ESIM_STATUSES))
+            )
+            .order_by(case((Order.esim_status == "IN_USE", 0), else_=1), Order.id)
+            .all()
+        )
+
+
+def _usage_mapping(order_id: int, data: dict) -> dict:
+    """
+    Translate API profile data into a bulk-update mapping for one Order row.
+    """
+    mapping = {"id": order_id, "updated_at": datetime.utcnow()}
+    if "orderUsage" in data:
+        mapping["order_usage"] = data["orderUsage"]
+    if "esimStatus" in data:
+        mapping["esim_status"] = data["esimStatus"]
+    if "smdpStatus" in data:
+        mapping["smdp_status"] = data["smdpStatus"]
+    expired_time = _parse_api_time(data.get("expiredTime"))
+    if expired_time:
+        mapping["expired_time"] = expired_time
+    if "lastUpdateTime" in data:
+        mapping["last_update_time"] = _parse_api_time(data["lastUpdateTime"])
+    return mapping
+
+
+def _apply_usage_batch(mappings: List[dict]) -> None:
+    """
+    Write one batch of usage updates with a single bulk UPDATE transaction.
+    """
+    with SyncSessionLocal() as session:
+        try:
+            session.bulk_update_mappings(Order, mappings)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+
+async def sync_usage_once(batch_size: int = USAGE_SYNC_BATCH_SIZE) -> int:
+    """
+    Sync usage and status for all non-terminal orders, batch by batch.
+    Statuses come from the shared profile index; unindexed ICCIDs are queried individually.
+    Returns the number of orders updated.
+    """
+    orders = await run_db(_load_active_orders)
+    if not orders:
+        return 0
+
+    if not await profile_index.refresh():
+        # Without a fresh index every ICCID would be queried one by one; retry next run instead
+        logger.warning(f"[Usage Sync] Profile index unavailable, skipping this run ({len(orders)} active orders)")
+        return 0
+    semaphore = asyncio.Semaphore(MY_ESIM_CONCURRENCY)
+    updated = 0
+    for start in range(0, len(orders), batch_size):
+        batch = orders[start:start + batch_size]
+        missing = list({iccid for _, iccid in batch if iccid not in profile_index.by_iccid})
+        entries = await asyncio.gather(
+            *(_fetch_esim_entry(iccid, semaphore, MY_ESIM_LOOKUP_TIMEOUT) for iccid in missing)
+        )
+        fetched = {entry["iccid"]: entry["data"] for entry in entries if entry["data"]}
+
+        mappings = []
+        for order_id, iccid in batch:
+            data = profile_index.by_iccid.get(iccid) or fetched.get(iccid)
+            if data:
+                mappings.append(_usage_mapping(order_id, data))
+        if mappings:
+            await run_db(_apply_usage_batch, mappings)
+            updated += len(mappings)
+
+    logger.info(f"[Usage Sync] Updated {updated}/{len(orders)} active orders")
+    return updated
+
+
+async def usage_sync_worker(interval: float = USAGE_SYNC_INTERVAL) -> None:
+    """
+    Run sync_usage_once every `interval` seconds until cancelled.
+    """
+    logger.info(f"[Usage Sync] Worker started (interval={interval}s, batch={USAGE_SYNC_BATCH_SIZE})")
+    backfilled = False
+    while True:
+        try:
+            await sync_usage_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("[Usage Sync] Sync run failed:")
+        if not backfilled:
+            # One-off: orders created before esim_tran_no existed, matched via the index just loaded
+            backfilled = True
+            try:
+                await run_db(backfill_esim_tran_nos, profile_index.by_iccid)
+            except Exception as e:
+                logger.warning(f"[DB Sync] Failed to backfill esimTranNo: {e}")
+        await asyncio.sleep(interval)
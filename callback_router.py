@@ -0,0 +1,132 @@
+"""
+Callback query routing for the Telegram bot.
+
+Callback data is either an exact action ("buy_local") or "<action><sep><argument>" with
+"_" or "|" as the separator ("local_DE", "topupdo|<tranNo>|<package>|<amount>"). Handlers
+are registered per exact action or per action token and looked up in a dict, so dispatch
+costs the same for every action instead of growing with a chain of startswith checks.
+
+Every route keeps call, error and timing counters; slow callbacks are logged as they
+happen and metrics() gives a snapshot of all routes for monitoring.
+"""
+
+import os
+import time
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Callbacks taking longer than this are logged with their route
+CALLBACK_SLOW_MS = float(os.getenv("CALLBACK_SLOW_MS", "2000"))
+
+# handler(update, context, argument); argument is "" for exact routes
+CallbackHandler = Callable[..., Awaitable[None]]
+
+
+class RouteStats:
+    """Calls, errors and handler time of one route."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed: float, failed: bool) -> None:
+        self.calls += 1
+        self.errors += failed
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_ms": round(self.total_time / self.calls * 1000, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_time * 1000, 3),
+            "total_ms": round(self.total_time * 1000, 3),
+        }
+
+
+def split_callback_data(data: str) -> Tuple[str, str]:
+    """("local", "DE") for "local_DE": the action token before the first "_" or "|" and the rest."""
+    cut = data.find("_")
+    bar = data.find("|")
+    if bar >= 0 and (cut < 0 or bar < cut):
+        cut = bar
+    if cut < 0:
+        return data, ""
+    return data[:cut], data[cut + 1:]
+
+
+class CallbackRouter:
+    """Maps callback data to handlers: exact actions first, then the action token."""
+
+    def __init__(self):
+        self.exact: Dict[str, Tuple[str, CallbackHandler]] = {}
+        self.prefixes: Dict[str, Tuple[str, CallbackHandler]] = {}
+        self.fallback: Optional[Tuple[str, CallbackHandler]] = None
+        self.stats: Dict[str, RouteStats] = {}
+
+    def _register(self, table: Optional[dict], key: str, name: str):
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            if table is not None and key in table:
+                raise ValueError(f"Callback route {name!r} is already registered")
+            route = (name, handler)
+            if table is None:
+                self.fallback = route
+            else:
+                table[key] = route
+            self.stats[name] = RouteStats()
+            return handler
+        return decorator
+
+    def exact_route(self, data: str):
+        """Register a handler for callback data equal to `data`."""
+        return self._register(self.exact, data, data)
+
+    def prefix_route(self, token: str):
+        """Register a handler for "<token>_<argument>" / "<token>|<argument>" callback data."""
+        return self._register(self.prefixes, token, f"{token}*")
+
+    def fallback_route(self):
+        """Register the handler for callback data no route matches."""
+        return self._register(None, "", "unknown")
+
+    def resolve(self, data: str) -> Tuple[Optional[str], Optional[CallbackHandler], str]:
+        """(route name, handler, argument) for `data`; the fallback (or Nones) if nothing matches."""
+        route = self.exact.get(data)
+        if route is not None:
+            return route[0], route[1], ""
+        token, argument = split_callback_data(data)
+        route = self.prefixes.get(token) if len(token) < len(data) else None
+        if route is None:
+            route = self.fallback
+            argument = data
+        if route is None:
+            return None, None, data
+        return route[0], route[1], argument
+
+    async def dispatch(self, update, context, data: str) -> None:
+        """Run the handler for `data`, recording its time and whether it raised."""
+        name, handler, argument = self.resolve(data)
+        if handler is None:
+            logger.warning(f"[Callbacks] No route for {data!r}")
+            return
+        start = time.perf_counter()
+        failed = True
+        try:
+            await handler(update, context, argument)
+            failed = False
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stats[name].record(elapsed, failed)
+            if elapsed * 1000 >= CALLBACK_SLOW_MS:
+                logger.warning(f"[Callbacks] Slow callback {name}: {elapsed * 1000:.0f} ms")
+
+    def metrics(self) -> Dict[str, dict]:
+        """Per-route counters of every route that was called, slowest total first."""
+        called = [(name, stats) for name, stats in self.stats.items() if stats.calls]
+        called.sort(key=lambda item: item[1].total_time, reverse=True)
+        return {name: stats.as_dict() for name, stats in called}
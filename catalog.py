@@ -0,0 +1,417 @@
+"""
+In-memory package catalog used by the bot.
+
+The package JSON files in public/ are loaded once into a Catalog, which indexes
+packages by packageCode, by location code, by region and by global GB tier and keeps
+each group pre-sorted by retail price, so every lookup in the bot is a dict access
+instead of a scan over the full package lists.
+
+When a new snapshot was published directly after the one loaded, the reloader applies
+its diff to the loaded lists instead of parsing all package files again.
+"""
+
+import os
+import re
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import snapshots
+import country_search
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_DIR = "public"
+GB = 1024 * 1024 * 1024
+
+# Files whose modification times define the catalog version on disk
+# (the snapshot manifest when fetch_packages has published one)
+CATALOG_FILES = (
+    "countries.json", "countryPackages.json", "regionalPackages.json", "globalPackages.json",
+    "lastUpdate.txt", f"{snapshots.SNAPSHOT_DIRNAME}/{snapshots.MANIFEST_FILENAME}"
+)
+# Snapshot file behind each package list of a Catalog
+CATALOG_PACKAGE_FILES = {
+    "country_packages": "countryPackages.json",
+    "regional_packages": "regionalPackages.json",
+    "global_packages": "globalPackages.json",
+}
+# Package fields shown by the Mini App list views; fetch_packages publishes a "Slim"
+# projection of each list with only these, full packages are served one by one on demand
+LIST_VIEW_FIELDS = (
+    "packageCode", "name", "price", "retailPrice", "currencyCode", "volume",
+    "duration", "durationUnit", "location", "speed", "supportTopUpType",
+)
+SLIM_FILES = {
+    "countryPackages.json": "countryPackagesSlim.json",
+    "regionalPackages.json": "regionalPackagesSlim.json",
+    "globalPackages.json": "globalPackagesSlim.json",
+}
+# Per-location / per-region shards of the Slim lists, plus an index of what is available
+SHARD_DIR = "shards"
+LOCATIONS_INDEX_FILE = f"{SHARD_DIR}/locations.json"
+CATALOG_RELOAD_INTERVAL = float(os.getenv("CATALOG_RELOAD_INTERVAL", "60"))
+
+# Country codes of each region. Regional packages are grouped by their location codes:
+# a package goes to the region covering the largest share of its locations (the smaller
+# region on ties, so e.g. Gulf wins over Middle East). "China" also holds Japan and
+# South Korea, which are only sold bundled with mainland China.
+REGION_COUNTRIES = {
+    "Europe": set(
+        "AD AL AT AX BA BE BG BY CH CY CZ DE DK EE ES FI FO FR GB GG GI GR HR HU IE IM IS IT JE "
+        "LI LT LU LV MC MD ME MK MT NL NO PL PT RO RS RU SE SI SK SM TR UA VA XK".split()
+    ),
+    "South America": set("AR BO BR BZ CL CO CR EC GF GT GY HN NI PA PE PY SR SV UY VE".split()),
+    "North America": set("CA MX US".split()),
+    "Africa": set(
+        "AO BF BI BJ BW CD CF CG CI CM CV DJ DZ EG ER ET GA GH GM GN GQ GW KE KM LR LS LY MA MG "
+        "ML MR MU MW MZ NA NE NG RE RW SC SD SL SN SO SS ST SZ TD TG TN TZ UG YT ZA ZM ZW".split()
+    ),
+    "Asia (excl. China)": set(
+        "AF AU BD BH BN BT FJ GE GU ID IL IN JO JP KG KH KR KW KZ LA LK MM MN MV MY NP NZ OM PG "
+        "PH PK PS QA SA SG TH TJ TL TM TW UZ VN".split()
+    ),
+    "China": set("CN HK MO JP KR".split()),
+    "Gulf": set("AE BH IQ KW OM QA SA".split()),
+    "Middle East": set("AE AM AZ BH EG IL IQ IR JO KW LB OM PS QA SA SY TR YE".split()),
+    "Caribbean": set(
+        "AG AI AN AW BB BL BQ BS CU CW DM DO GD GP HT JM KN KY LC MF MQ MS PR SX TC TT VC VG VI".split()
+    ),
+}
+# Regions only considered for packages that include at least one of these locations,
+# so e.g. a Japan & South Korea package is not filed under China
+REGION_REQUIRED_LOCATIONS = {
+    "China": set("CN HK MO".split()),
+}
+# Minimum share of a package's locations a region must cover to be picked by location
+REGION_MIN_COVERAGE = 0.5
+
+# Name-based region detection, used for packages the location codes cannot place
+REGION_ICONS = {
+    "Europe": lambda pkg: "Europe" in pkg.get("name", ""),
+    "South America": lambda pkg: "South America" in pkg.get("name", ""),
+    "North America": lambda pkg: "North America" in pkg.get("name", ""),
+    "Africa": lambda pkg: "Africa" in pkg.get("name", ""),
+    "Asia (excl. China)": lambda pkg: ("Asia" in pkg.get("name", "") or "Singapore" in pkg.get("name", "")),
+    "China": lambda pkg: ("China" in pkg.get("name", "")),
+    "Gulf": lambda pkg: "Gulf" in pkg.get("name", ""),
+    "Middle East": lambda pkg: "Middle East" in pkg.get("name", ""),
+    "Caribbean": lambda pkg: "Caribbean" in pkg.get("name", "")
+}
+
+GLOBAL_PACKAGE_TYPES = {
+    "Global 1GB": 1,
+    "Global 3GB": 3,
+    "Global 5GB": 5,
+    "Global 10GB": 10,
+    "Global 20GB": 20,
+}
+
+
+def load_json(path: str, default, strict: bool = False):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        if strict:
+            raise
+        logger.error(f"Error loading {path}: {e}")
+        return default
+
+
+def read_version(public_dir: str = PUBLIC_DIR) -> str:
+    """The catalog version is the timestamp fetch_packages writes to lastUpdate.txt."""
+    try:
+        with open(f"{public_dir}/lastUpdate.txt", "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def catalog_stamp(public_dir: str = PUBLIC_DIR) -> Tuple[Optional[int], ...]:
+    """Modification times of the catalog files; changes whenever any file is rewritten."""
+    stamp = []
+    for filename in CATALOG_FILES:
+        try:
+            stamp.append(os.stat(f"{public_dir}/{filename}").st_mtime_ns)
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def location_codes(pkg: dict) -> List[str]:
+    """Location codes of a package, from "location" or else from its locationNetworkList."""
+    if pkg.get("location"):
+        return pkg["location"].split(",")
+    return [network["locationCode"] for network in pkg.get("locationNetworkList") or [] if network.get("locationCode")]
+
+
+def package_region(pkg: dict) -> Optional[str]:
+    """
+    Region of a regional package: by location coverage (see REGION_COUNTRIES),
+    falling back to the name predicates when no region covers enough of its locations.
+    """
+    codes = set(location_codes(pkg))
+    if codes:
+        coverage, _, region = max(
+            (len(codes & countries) / len(codes), -len(countries), region)
+            for region, countries in REGION_COUNTRIES.items()
+            if codes & REGION_REQUIRED_LOCATIONS.get(region, codes)
+        )
+        if coverage >= REGION_MIN_COVERAGE:
+            return region
+    return next((region for region, predicate in REGION_ICONS.items() if predicate(pkg)), None)
+
+
+def global_tier(pkg: dict) -> int:
+    """GB tier of a global package, as used by the 'globalcat_' buttons."""
+    return int(round(pkg.get("volume", 0) / GB))
+
+
+def sort_by_retail_price(packages: List[dict]) -> List[dict]:
+    return sorted(packages, key=lambda p: p.get("retailPrice", 0))
+
+
+def slim_package(pkg: dict) -> dict:
+    return {field: pkg[field] for field in LIST_VIEW_FIELDS if field in pkg}
+
+
+def slim_projections(files: Dict[str, List[dict]]) -> Dict[str, List[dict]]:
+    """List-view projections (see SLIM_FILES) of the package files present in `files`."""
+    return {
+        slim_name: [slim_package(pkg) for pkg in files[filename]]
+        for filename, slim_name in SLIM_FILES.items()
+        if filename in files
+    }
+
+
+def region_key(region: str) -> str:
+    """URL-safe key of a region, e.g. "Asia (excl. China)" -> "asia-excl-china"."""
+    return re.sub(r"[^a-z0-9]+", "-", region.lower()).strip("-")
+
+
+def shard_filename(key: str) -> str:
+    return f"{SHARD_DIR}/{key}.json"
+
+
+def price_summary(packages: List[dict]) -> dict:
+    return {
+        "count": len(packages),
+        "minRetailPrice": min((pkg.get("retailPrice", 0) for pkg in packages), default=None),
+    }
+
+
+def location_shards(files: Dict[str, List[dict]], countries: Dict[str, str]) -> Dict[str, object]:
+    """
+    Slim, price-sorted package list per country code and per region (shards/<key>.json)
+    and the locations index (shards/locations.json) listing every shard.
+    """
+    shard_catalog = Catalog(
+        countries=countries,
+        country_packages=files["countryPackages.json"],
+        regional_packages=files["regionalPackages.json"],
+        global_packages=files["globalPackages.json"],
+    )
+    shards = {}
+    index = {"countries": [], "regions": []}
+    for code, packages in shard_catalog.by_location.items():
+        if not code:
+            continue
+        shards[shard_filename(code)] = [slim_package(pkg) for pkg in packages]
+        index["countries"].append({"code": code, "name": countries.get(code, code), **price_summary(packages)})
+    for region, packages in shard_catalog.by_region.items():
+        if not packages:
+            continue
+        key = region_key(region)
+        shards[shard_filename(key)] = [slim_package(pkg) for pkg in packages]
+        index["regions"].append({"key": key, "name": region, **price_summary(packages)})
+    index["countries"].sort(key=lambda country: country["name"])
+    shards[LOCATIONS_INDEX_FILE] = index
+    return shards
+
+
+def apply_package_changes(packages: List[dict], changes: dict) -> List[dict]:
+    """Apply one file's diff (see snapshots.diff_packages) to a package list."""
+    removed = set(changes["removed"])
+    changed = {change["packageCode"]: change["package"] for change in changes["changed"]}
+    updated = [
+        changed.get(pkg.get("packageCode"), pkg)
+        for pkg in packages
+        if pkg.get("packageCode") not in removed
+    ]
+    return updated + changes["added"]
+
+
+class Catalog:
+    """
+    Indexed, read-only view of the package lists.
+    Lists returned by the lookup methods are shared and must not be mutated.
+    """
+
+    def __init__(
+        self,
+        countries: Dict[str, str],
+        country_packages: List[dict],
+        regional_packages: List[dict],
+        global_packages: List[dict],
+        version: str = ""
+    ):
+        self.version = version
+        # Short fingerprint of the version, small enough for Telegram callback_data
+        self.version_tag = hashlib.blake2s(version.encode("utf-8"), digest_size=4).hexdigest()
+        self.countries = [{"code": code, "name": name} for code, name in countries.items()]
+        self.countries_by_code = {country["code"]: country for country in self.countries}
+        self.country_packages = country_packages
+        self.regional_packages = regional_packages
+        self.global_packages = global_packages
+
+        # Same precedence as the old lookups: country, then regional, then global
+        self.by_code: Dict[str, dict] = {}
+        for packages in (country_packages, regional_packages, global_packages):
+            for pkg in packages:
+                if pkg.get("packageCode"):
+                    self.by_code.setdefault(pkg["packageCode"], pkg)
+
+        by_location: Dict[str, List[dict]] = {}
+        for pkg in country_packages:
+            by_location.setdefault(pkg.get("location"), []).append(pkg)
+        self.by_location = {code: sort_by_retail_price(pkgs) for code, pkgs in by_location.items()}
+        self.country_codes_with_packages = set(self.by_location)
+        self.search_index = country_search.CountrySearchIndex(self.countries, self.country_codes_with_packages)
+
+        # Region and tier membership is computed once here; lookups return ready, sorted lists
+        by_region: Dict[str, List[dict]] = {region: [] for region in REGION_ICONS}
+        for pkg in regional_packages:
+            region = package_region(pkg)
+            if region is not None:
+                by_region[region].append(pkg)
+        self.by_region = {region: sort_by_retail_price(pkgs) for region, pkgs in by_region.items()}
+
+        by_global_tier: Dict[int, List[dict]] = {}
+        for pkg in global_packages:
+            by_global_tier.setdefault(global_tier(pkg), []).append(pkg)
+        self.by_global_tier = {tier: sort_by_retail_price(pkgs) for tier, pkgs in by_global_tier.items()}
+
+    def package(self, package_code: str) -> Optional[dict]:
+        return self.by_code.get(package_code)
+
+    def location_packages(self, location_code: str) -> List[dict]:
+        return self.by_location.get(location_code, [])
+
+    def region_packages(self, region: str) -> List[dict]:
+        return self.by_region.get(region, [])
+
+    def global_tier_packages(self, tier: int) -> List[dict]:
+        return self.by_global_tier.get(tier, [])
+
+    def with_changes(self, diff: dict, manifest: dict) -> Optional["Catalog"]:
+        """
+        New Catalog with a snapshot diff applied, or None if the result does not match
+        the package counts in the manifest (the caller should then do a full load).
+        """
+        lists = {}
+        for attr, filename in CATALOG_PACKAGE_FILES.items():
+            packages = getattr(self, attr)
+            if filename in diff["files"]:
+                packages = apply_package_changes(packages, diff["files"][filename])
+            if len(packages) != manifest["files"].get(filename, {}).get("count"):
+                return None
+            lists[attr] = packages
+        return Catalog(
+            countries={country["code"]: country["name"] for country in self.countries},
+            version=manifest["version"],
+            **lists,
+        )
+
+
+def load_catalog(public_dir: str = PUBLIC_DIR, strict: bool = False) -> Catalog:
+    """
+    Read the package JSON files and build a Catalog from them.
+    Package lists are read from the current snapshot when one is published.
+    With strict=True any unreadable file raises instead of yielding an empty list.
+    """
+    manifest = snapshots.read_manifest(public_dir)
+
+    def path(filename):
+        return snapshots.resolve_path(filename, manifest, public_dir)
+
+    return Catalog(
+        countries=load_json(f"{public_dir}/countries.json", {}, strict),
+        country_packages=load_json(path("countryPackages.json"), [], strict),
+        regional_packages=load_json(path("regionalPackages.json"), [], strict),
+        global_packages=load_json(path("globalPackages.json"), [], strict),
+        version=manifest["version"] if manifest else read_version(public_dir),
+    )
+
+
+class CatalogReloader:
+    """
+    Holds the current Catalog and swaps in a freshly built one when the files on disk change.
+
+    Parsing happens in a worker thread; the swap is a single attribute assignment, so a
+    handler that grabbed `current` keeps a consistent snapshot for its whole run.
+    """
+
+    def __init__(self, public_dir: str = PUBLIC_DIR):
+        self.public_dir = public_dir
+        self.stamp = catalog_stamp(public_dir)
+        self.current = load_catalog(public_dir)
+
+    def _load_incremental(self, stamp) -> Tuple[Optional[Catalog], bool]:
+        """
+        Try to get the new catalog without parsing every package file again.
+        Returns (catalog or None, unchanged): unchanged is True when only files outside
+        the snapshot (e.g. lastUpdate.txt) were rewritten.
+        """
+        countries_index = CATALOG_FILES.index("countries.json")
+        if stamp[countries_index] != self.stamp[countries_index]:
+            return None, False
+        manifest = snapshots.read_manifest(self.public_dir)
+        if not manifest or not self.current.version:
+            return None, False
+        if manifest["version"] == self.current.version:
+            return None, True
+        if manifest.get("previousVersion") != self.current.version:
+            return None, False
+        diff = snapshots.read_diff(manifest["version"], self.public_dir)
+        if diff is None:
+            return None, False
+        return self.current.with_changes(diff, manifest), False
+
+    async def reload_if_changed(self) -> bool:
+        stamp = await asyncio.to_thread(catalog_stamp, self.public_dir)
+        if stamp == self.stamp:
+            return False
+        try:
+            new_catalog, unchanged = await asyncio.to_thread(self._load_incremental, stamp)
+            if unchanged:
+                self.stamp = stamp
+                return False
+            mode = "delta"
+            if new_catalog is None:
+                mode = "full"
+                new_catalog = await asyncio.to_thread(load_catalog, self.public_dir, True)
+        except Exception as e:
+            # Most likely caught mid-rewrite; keep serving the old catalog and retry next tick
+            logger.warning(f"[Catalog] Reload skipped, files not readable yet: {e}")
+            return False
+        self.current = new_catalog
+        self.stamp = stamp
+        logger.info(
+            f"[Catalog] Reloaded version {new_catalog.version or '-'} "
+            f"({len(new_catalog.by_code)} packages, {mode})"
+        )
+        return True
+
+    async def watch(self, interval: float = CATALOG_RELOAD_INTERVAL) -> None:
+        """Poll the catalog files every `interval` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reload_if_changed()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("[Catalog] Reload failed:")
@@ -0,0 +1,268 @@
+"""
+Country search index for the bot's "Local" flow and the Mini App.
+
+Built once per catalog from the country names, ISO codes and the aliases / native names
+below. Lookups go through a prefix map and a trigram index instead of scanning every
+country, and tolerate a typo or two for longer queries. Results are ranked:
+exact name/alias/code, name prefix, word prefix, substring, then fuzzy matches.
+"""
+
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Common alternative English names and abbreviations
+COUNTRY_ALIASES = {
+    "US": ["USA", "America", "United States of America", "US"],
+    "GB": ["UK", "Great Britain", "Britain", "England", "Scotland", "Wales"],
+    "AE": ["UAE", "Emirates", "Dubai", "Abu Dhabi"],
+    "NL": ["Holland"],
+    "KR": ["Korea"],
+    "CZ": ["Czechia"],
+    "CI": ["Ivory Coast"],
+    "CV": ["Cape Verde"],
+    "SZ": ["Swaziland"],
+    "MM": ["Burma"],
+    "LA": ["Laos"],
+    "SY": ["Syria"],
+    "VA": ["Vatican"],
+    "BN": ["Brunei"],
+    "MO": ["Macau"],
+    "TR": ["Turkiye"],
+    "RU": ["Russian Federation"],
+    "MK": ["Macedonia"],
+    "BA": ["Bosnia"],
+    "DO": ["Dominican Rep"],
+    "CD": ["DR Congo", "DRC"],
+    "TL": ["East Timor"],
+    "AX": ["Aland"],
+}
+
+# Native-language names (and Russian names, which many of our users type)
+NATIVE_NAMES = {
+    "AE": ["الإمارات", "ОАЭ", "Эмираты"],
+    "AM": ["Հայաստան", "Армения"],
+    "AT": ["Österreich", "Австрия"],
+    "AZ": ["Azərbaycan", "Азербайджан"],
+    "BE": ["België", "Belgique", "Бельгия"],
+    "BG": ["България", "Болгария"],
+    "BR": ["Brasil", "Бразилия"],
+    "BY": ["Беларусь"],
+    "CH": ["Schweiz", "Suisse", "Svizzera", "Швейцария"],
+    "CN": ["中国", "Китай"],
+    "CY": ["Κύπρος", "Кипр"],
+    "CZ": ["Česko", "Чехия"],
+    "DE": ["Deutschland", "Германия"],
+    "DK": ["Danmark", "Дания"],
+    "EG": ["مصر", "Египет"],
+    "ES": ["España", "Испания"],
+    "FI": ["Suomi", "Финляндия"],
+    "FR": ["Франция"],
+    "GB": ["Великобритания", "Англия"],
+    "GE": ["საქართველო", "Грузия"],
+    "GR": ["Ελλάδα", "Hellas", "Греция"],
+    "HR": ["Hrvatska", "Хорватия"],
+    "HU": ["Magyarország", "Венгрия"],
+    "ID": ["Индонезия"],
+    "IL": ["ישראל", "Израиль"],
+    "IN": ["Bharat", "Индия"],
+    "IT": ["Italia", "Италия"],
+    "JP": ["日本", "Nippon", "Япония"],
+    "KG": ["Кыргызстан", "Киргизия"],
+    "KR": ["대한민국", "Южная Корея", "Корея"],
+    "KZ": ["Қазақстан", "Казахстан"],
+    "ME": ["Crna Gora", "Черногория"],
+    "MV": ["Мальдивы"],
+    "MX": ["México", "Мексика"],
+    "NL": ["Nederland", "Нидерланды", "Голландия"],
+    "NO": ["Norge", "Норвегия"],
+    "PL": ["Polska", "Польша"],
+    "PT": ["Португалия"],
+    "RO": ["România", "Румыния"],
+    "RS": ["Србија", "Srbija", "Сербия"],
+    "RU": ["Россия"],
+    "SE": ["Sverige", "Швеция"],
+    "TH": ["ประเทศไทย", "Таиланд", "Тайланд"],
+    "TR": ["Türkiye", "Турция"],
+    "UA": ["Україна", "Украина"],
+    "US": ["США", "Америка"],
+    "UZ": ["Oʻzbekiston", "Узбекистан"],
+    "VN": ["Việt Nam", "Вьетнам"],
+}
+
+PREFIX_MAX_LENGTH = 16
+SUBSTRING_MIN_LENGTH = 3
+# Fuzzy matching only checks the terms sharing the most trigrams with the query
+FUZZY_CANDIDATES = 8
+# Results of recent queries are kept per index (the index never changes once built)
+RESULT_CACHE_SIZE = 1024
+
+# Result ranks, best first
+RANK_EXACT = 0
+RANK_NAME_PREFIX = 1
+RANK_WORD_PREFIX = 2
+RANK_SUBSTRING = 3
+RANK_FUZZY = 4
+
+
+def normalize(text: str) -> str:
+    """Casefolded, accent-free, punctuation-free form used for both terms and queries."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(re.sub(r"[^\w]+", " ", text).split())
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Levenshtein distance, or limit + 1 as soon as it is known to exceed `limit`.
+    Only the diagonal band of width `limit` is computed.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if a == b:
+        return 0
+    over = limit + 1
+    previous = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        ca = a[i - 1]
+        current = [over] * (len(b) + 1)
+        current[0] = row_min = i if i <= limit else over
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            cost = previous[j - 1] + (ca != b[j - 1])
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost
+            if cost < row_min:
+                row_min = cost
+        if row_min > limit:
+            return over
+        previous = current
+    return min(previous[-1], over)
+
+
+def typo_limit(query: str) -> int:
+    """Edits tolerated for a query: none for very short ones, 1 up to 5 characters, 2 beyond."""
+    if len(query) < 4:
+        return 0
+    return 1 if len(query) <= 5 else 2
+
+
+class CountrySearchIndex:
+    """Search index over country names, ISO codes, aliases and native names."""
+
+    def __init__(self, countries: Iterable[dict], codes: Optional[Set[str]] = None):
+        """`countries` are {"code", "name"} dicts; only codes in `codes` are indexed if given."""
+        self.names: Dict[str, str] = {}
+        self.terms: List[Tuple[str, str]] = []          # (normalized term, country code)
+        self.term_words: List[Tuple[str, ...]] = []     # the term and its words, for fuzzy matching
+        self.exact: Dict[str, Set[str]] = {}
+        self.prefixes: Dict[str, Set[int]] = {}
+        self.trigrams: Dict[str, Set[int]] = {}
+        self._results: Dict[Tuple[str, int], List[dict]] = {}
+
+        for country in countries:
+            code = country["code"]
+            if codes is not None and code not in codes:
+                continue
+            self.names[code] = country["name"]
+            self.exact.setdefault(code.casefold(), set()).add(code)
+            for term in [country["name"], *COUNTRY_ALIASES.get(code, []), *NATIVE_NAMES.get(code, [])]:
+                self._add_term(normalize(term), code)
+
+    def _add_term(self, term: str, code: str) -> None:
+        if not term:
+            return
+        term_id = len(self.terms)
+        self.terms.append((term, code))
+        self.exact.setdefault(term, set()).add(code)
+        words = term.split()
+        self.term_words.append(tuple(dict.fromkeys([term, *words])))
+        for start in [0] + [i + 1 for i, ch in enumerate(term) if ch == " "]:
+            for end in range(start + 1, min(len(term), start + PREFIX_MAX_LENGTH) + 1):
+                self.prefixes.setdefault(term[start:end], set()).add(term_id)
+        for gram in trigrams(term):
+            self.trigrams.setdefault(gram, set()).add(term_id)
+        for word in words[1:]:
+            for gram in trigrams(word):
+                self.trigrams.setdefault(gram, set()).add(term_id)
+
+    def _fuzzy_distance(self, query: str, term_id: int, limit: int) -> int:
+        """Best distance of the query to the term or one of its words (whole, or their prefix of the query's length)."""
+        best = limit + 1
+        for word in self.term_words[term_id]:
+            best = min(best, edit_distance(query, word, limit))
+            if len(word) > len(query):
+                best = min(best, edit_distance(query, word[:len(query)], limit))
+            if best == 0:
+                break
+        return best
+
+    def search(self, query: str, limit: int = 10) -> List[dict]:
+        """Ranked matches: [{"code", "name", "rank"}], best first, at most `limit`. Do not mutate."""
+        q = normalize(query)
+        if not q:
+            return []
+        cached = self._results.get((q, limit))
+        if cached is None:
+            cached = self._search(q, limit)
+            if len(self._results) >= RESULT_CACHE_SIZE:
+                self._results.clear()
+            self._results[(q, limit)] = cached
+        return cached
+
+    def _search(self, q: str, limit: int) -> List[dict]:
+        best: Dict[str, int] = {}
+
+        def hit(code: str, rank: int) -> None:
+            if rank < best.get(code, RANK_FUZZY + 10):
+                best[code] = rank
+
+        for code in self.exact.get(q, ()):
+            hit(code, RANK_EXACT)
+
+        for term_id in self.prefixes.get(q[:PREFIX_MAX_LENGTH], ()):
+            term, code = self.terms[term_id]
+            if term.startswith(q):
+                hit(code, RANK_NAME_PREFIX)
+            elif f" {q}" in f" {term}":
+                hit(code, RANK_WORD_PREFIX)
+
+        query_grams = trigrams(q)
+        if len(q) >= SUBSTRING_MIN_LENGTH:
+            # Substrings: every trigram inside the query also occurs in the term
+            inner = [gram for gram in query_grams if " " not in gram]
+            postings = sorted((self.trigrams.get(gram, set()) for gram in inner), key=len)
+            candidates = set.intersection(*postings) if postings else set()
+        else:
+            # Shorter than a trigram: the term list is small enough to check directly
+            candidates = range(len(self.terms))
+        for term_id in candidates:
+            term, code = self.terms[term_id]
+            if q in term:
+                hit(code, RANK_SUBSTRING)
+
+        max_edits = typo_limit(q)
+        if max_edits and len(best) < limit:
+            # A term within k edits shares all but at most 3k of the query's trigrams
+            shared = Counter()
+            for gram in query_grams:
+                shared.update(self.trigrams.get(gram, ()))
+            needed = max(1, len(query_grams) - 3 * max_edits)
+            for term_id, count in shared.most_common(FUZZY_CANDIDATES):
+                term, code = self.terms[term_id]
+                if count < needed or code in best:
+                    continue
+                distance = self._fuzzy_distance(q, term_id, max_edits)
+                if distance <= max_edits:
+                    hit(code, RANK_FUZZY + distance)
+
+        ranked = sorted(best.items(), key=lambda item: (item[1], self.names[item[0]]))
+        return [{"code": code, "name": self.names[code], "rank": rank} for code, rank in ranked[:limit]]
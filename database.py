@@ -1,8 +1,15 @@
 # database.py
 import os
+import time
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,7 +18,117 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise Exception("DATABASE_URL is not set in your environment variables.")
 
-engine = create_engine(DATABASE_URL)
+# Connection pools are split per workload so a burst in one (e.g. the usage sync)
+# cannot starve the others. Every setting can be given per workload as
+# DB_<WORKLOAD>_<SETTING> (e.g. DB_BOT_POOL_SIZE) with DB_<SETTING> as the fallback.
+WORKLOADS = ("web", "bot", "sync")
+
+POOL_DEFAULTS = {
+    "POOL_SIZE": "5",
+    "MAX_OVERFLOW": "10",
+    "POOL_TIMEOUT": "30",          # seconds to wait for a free connection
+    "POOL_RECYCLE": "1800",        # seconds before a connection is replaced
+    "POOL_PRE_PING": "true",
+    "STATEMENT_TIMEOUT": "0",      # milliseconds, PostgreSQL only; 0 disables it
+}
+
+
+def pool_setting(workload: str, name: str) -> str:
+    return os.getenv(f"DB_{workload.upper()}_{name}", os.getenv(f"DB_{name}", POOL_DEFAULTS[name]))
+
+
+class PoolWaitStats:
+    """Counts connection checkouts and how long callers waited for them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+
+def _metered_pool_class(stats: PoolWaitStats):
+    # Defined per workload so pool.recreate() (which reuses self.__class__) keeps the same stats.
+    class MeteredQueuePool(QueuePool):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                stats.record(time.perf_counter() - start)
+
+    return MeteredQueuePool
+
+
+def create_workload_engine(workload: str):
+    """Create the engine for one workload using its pool settings."""
+    connect_args = {}
+    statement_timeout = int(pool_setting(workload, "STATEMENT_TIMEOUT"))
+    if statement_timeout and DATABASE_URL.startswith("postgres"):
+        connect_args["options"] = f"-c statement_timeout={statement_timeout}"
+
+    stats = PoolWaitStats()
+    pool_wait_stats[workload] = stats
+    return create_engine(
+        DATABASE_URL,
+        poolclass=_metered_pool_class(stats),
+        pool_size=int(pool_setting(workload, "POOL_SIZE")),
+        max_overflow=int(pool_setting(workload, "MAX_OVERFLOW")),
+        pool_timeout=float(pool_setting(workload, "POOL_TIMEOUT")),
+        pool_recycle=int(pool_setting(workload, "POOL_RECYCLE")),
+        pool_pre_ping=pool_setting(workload, "POOL_PRE_PING").lower() == "true",
+        connect_args=connect_args,
+    )
+
+
+pool_wait_stats: Dict[str, PoolWaitStats] = {}
+engines = {workload: create_workload_engine(workload) for workload in WORKLOADS}
+
+# Default engine/session factory (FastAPI app and table creation)
+engine = engines["web"]
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Telegram bot handlers
+BotSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engines["bot"])
+# Background jobs (usage sync, backfills)
+SyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engines["sync"])
 
 Base = declarative_base()
+
+
+def pool_metrics(workloads=WORKLOADS) -> dict:
+    """
+    Snapshot of the given workload pools, for monitoring. Pools are per process:
+    report only the workloads the calling process actually uses.
+    """
+    metrics = {}
+    for workload in workloads:
+        pool = engines[workload].pool
+        stats = pool_wait_stats[workload]
+        metrics[workload] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "checkouts": stats.checkouts,
+            "avg_wait_ms": round(stats.total_wait / stats.checkouts * 1000, 3) if stats.checkouts else 0.0,
+            "max_wait_ms": round(stats.max_wait * 1000, 3),
+        }
+    return metrics
+
+
+# Dedicated thread pool for blocking SQLAlchemy work, so async handlers never
+# run queries/commits on the event loop itself.
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "8"))
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+
+async def run_db(fn, *args, **kwargs):
+    """Run a blocking DB function on the DB thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(fn, *args, **kwargs))
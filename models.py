@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, DateTime, BigInteger, Text
+import logging
+from sqlalchemy import Column, Integer, String, DateTime, BigInteger, Text, inspect, text
 from sqlalchemy.sql import func
 from database import Base
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, Index
 
 class User(Base):
     __tablename__ = "users"
@@ -25,6 +26,7 @@ class Order(Base):
     order_id = Column(String, index=True)  # Order number returned by the API.
     transaction_id = Column(String, index=True)  # External transaction ID from payment.
     iccid = Column(String, nullable=True)                     # ICCID from the allocated profile.
+    esim_tran_no = Column(String, index=True, nullable=True)  # esimTranNo of the allocated profile.
     
     # Purchase details
     count = Column(Integer, default=1)         # Number of packages/days ordered.
@@ -54,3 +56,43 @@ class Order(Base):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         print(f"[DEBUG] New Order instance created: {kwargs}")
+
+class PackagePrice(Base):
+    """
+    Append-only price history: one row per package whenever a catalog refresh sees
+    its price or retail price change (and on its first appearance).
+    """
+    __tablename__ = "package_prices"
+    __table_args__ = (Index("ix_package_prices_code_fetched_at", "package_code", "fetched_at"),)
+    id = Column(Integer, primary_key=True)
+    package_code = Column(String, nullable=False)
+    fetched_at = Column(DateTime(timezone=True), nullable=False)  # When the refresh fetched this price.
+    price = Column(Integer)           # Cost price in the smallest currency unit.
+    retail_price = Column(Integer)    # Our price after the pricing rules.
+    currency_code = Column(String)
+
+
+def migrate_schema(bind) -> None:
+    """
+    Bring existing tables up to the models: create_all only creates missing tables, so
+    nullable columns added to a model later (e.g. orders.esim_tran_no) are added here,
+    together with their indexes. Safe to run on every startup.
+    """
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            if not column.nullable:
+                logging.error(f"[Schema] {table.name}.{column.name} is missing and NOT NULL, add it by hand")
+                continue
+            column_type = column.type.compile(dialect=bind.dialect)
+            with bind.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            logging.info(f"[Schema] Added column {table.name}.{column.name}")
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
@@ -0,0 +1,87 @@
+"""
+Price history of catalog packages.
+
+Every fetch_packages run records the wholesale price and our retail price of each
+package in the package_prices table, but only when they differ from the latest stored
+point, so the table stays small and append-only. price_at answers "what did package X
+cost at time T" from the (package_code, fetched_at) index.
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import SyncSessionLocal
+from models import PackagePrice
+
+logger = logging.getLogger(__name__)
+
+
+def latest_prices(db: Session) -> Dict[str, Tuple[Optional[int], Optional[int]]]:
+    """Latest stored (price, retail_price) per package code."""
+    latest = (
+        db.query(PackagePrice.package_code, func.max(PackagePrice.fetched_at).label("fetched_at"))
+        .group_by(PackagePrice.package_code)
+        .subquery()
+    )
+    rows = (
+        db.query(PackagePrice.package_code, PackagePrice.price, PackagePrice.retail_price)
+        .join(
+            latest,
+            (PackagePrice.package_code == latest.c.package_code)
+            & (PackagePrice.fetched_at == latest.c.fetched_at),
+        )
+        .all()
+    )
+    return {code: (price, retail_price) for code, price, retail_price in rows}
+
+
+def record_prices(packages: Iterable[dict], fetched_at: datetime) -> int:
+    """
+    Append a price point for every package whose price or retail price changed since
+    its latest stored point. Blocking; run it via run_db. Returns the number of rows added.
+    """
+    db = SyncSessionLocal()
+    try:
+        previous = latest_prices(db)
+        rows = []
+        seen = set()
+        for pkg in packages:
+            code = pkg.get("packageCode")
+            if not code or code in seen:
+                continue
+            seen.add(code)
+            point = (pkg.get("price"), pkg.get("retailPrice"))
+            if previous.get(code) == point:
+                continue
+            rows.append({
+                "package_code": code,
+                "fetched_at": fetched_at,
+                "price": point[0],
+                "retail_price": point[1],
+                "currency_code": pkg.get("currencyCode"),
+            })
+        if rows:
+            db.bulk_insert_mappings(PackagePrice, rows)
+            db.commit()
+        logger.info(f"[Price History] Recorded {len(rows)} price changes out of {len(seen)} packages")
+        return len(rows)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"[Price History] Failed to record prices: {e}")
+        raise
+    finally:
+        db.close()
+
+
+def price_at(db: Session, package_code: str, at: datetime) -> Optional[PackagePrice]:
+    """The price point of a package in effect at `at` (None if it was not known yet)."""
+    return (
+        db.query(PackagePrice)
+        .filter(PackagePrice.package_code == package_code, PackagePrice.fetched_at <= at)
+        .order_by(PackagePrice.fetched_at.desc())
+        .first()
+    )
@@ -0,0 +1,270 @@
+"""
+Rule-driven retail pricing for the package catalog.
+
+Replaces the hard-coded markup loop of the old adjust_prices. Rules can target locations,
+package kinds (local / regional / global) and volume bands; the first matching rule wins.
+Each rule sets:
+  - missing_bp:    retail price when the API gives none (retailPrice == 0)
+  - min_markup_bp: retail prices at or below price * min_markup are raised to ...
+  - floor_bp:      ... price * floor
+  - cap_bp:        retail prices above price * cap are capped to it
+Multipliers are in basis points (15000 = 1.5x) and all arithmetic stays in integer minor
+units, so prices never turn into floats. How often each rule and action fired
+(e.g. "default:cap") is returned as a Counter for logging; nothing extra is written into
+the published packages.
+
+With rules that have no criteria (the default) every package is priced in one pass
+without any rule lookup. Otherwise rule selection is memoised per distinct
+(location, kind, volume band) and each rule's packages are priced as one group.
+
+Rules can be overridden with a JSON list of rule objects in the file named by PRICING_RULES_FILE.
+"""
+
+import os
+import json
+import logging
+from bisect import bisect_right
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 * 1024 * 1024
+BP = 10000
+PRICING_RULES_FILE = os.getenv("PRICING_RULES_FILE", "")
+
+# Package kinds, by the list a package is published in
+KIND_LOCAL = "local"
+KIND_REGIONAL = "regional"
+KIND_GLOBAL = "global"
+
+
+class PricingRule:
+    """One markup rule; criteria left as None match everything."""
+
+    def __init__(
+        self,
+        name: str,
+        locations: Optional[Iterable[str]] = None,
+        kinds: Optional[Iterable[str]] = None,
+        min_volume_gb: Optional[float] = None,
+        max_volume_gb: Optional[float] = None,
+        missing_bp: int = 30000,
+        min_markup_bp: int = 10000,
+        floor_bp: int = 15000,
+        cap_bp: int = 30000,
+    ):
+        self.name = name
+        self.locations = set(locations) if locations is not None else None
+        self.kinds = set(kinds) if kinds is not None else None
+        self.min_volume = int(min_volume_gb * GB) if min_volume_gb is not None else None
+        self.max_volume = int(max_volume_gb * GB) if max_volume_gb is not None else None
+        self.missing_bp = int(missing_bp)
+        self.min_markup_bp = int(min_markup_bp)
+        self.floor_bp = int(floor_bp)
+        self.cap_bp = int(cap_bp)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PricingRule":
+        return cls(**data)
+
+    def matches(self, location: str, kind: str, volume: int) -> bool:
+        """Volume bands are [min_volume_gb, max_volume_gb)."""
+        if self.locations is not None and location not in self.locations:
+            return False
+        if self.kinds is not None and kind not in self.kinds:
+            return False
+        if self.min_volume is not None and volume < self.min_volume:
+            return False
+        if self.max_volume is not None and volume >= self.max_volume:
+            return False
+        return True
+
+    def __repr__(self) -> str:
+        return f"<PricingRule {self.name}>"
+
+
+# Same behaviour as the old adjust_prices: 3x when missing, 1.5x when at or below cost, capped at 3x
+DEFAULT_RULES = [PricingRule("default")]
+
+
+def load_rules(path: str = PRICING_RULES_FILE) -> List[PricingRule]:
+    """Rules from a JSON file (list of PricingRule keyword dicts), else DEFAULT_RULES."""
+    if not path:
+        return DEFAULT_RULES
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            rules = [PricingRule.from_dict(data) for data in json.load(f)]
+    except Exception as e:
+        logger.error(f"[Pricing] Failed to load rules from {path}, using defaults: {e}")
+        return DEFAULT_RULES
+    if not rules:
+        return DEFAULT_RULES
+    return rules
+
+
+class RuleSelector:
+    """
+    First matching rule for a package, memoised per distinct (location, kind, volume band).
+    Locations and kinds only become part of the key if some rule looks at them.
+    """
+
+    def __init__(self, rules: Sequence[PricingRule]):
+        self.rules = rules
+        self.use_location = any(rule.locations is not None for rule in rules)
+        self.use_kind = any(rule.kinds is not None for rule in rules)
+        self.bounds = sorted(
+            {rule.min_volume for rule in rules if rule.min_volume is not None}
+            | {rule.max_volume for rule in rules if rule.max_volume is not None}
+        )
+        # No rule has criteria: the first one applies to every package
+        self.first_rule_only = bool(rules) and not (self.use_location or self.use_kind or self.bounds)
+        self._cache: Dict[Tuple[str, str, int], Optional[int]] = {}
+
+    def _select(self, key: Tuple[str, str, int], location: str, kind: str, volume: int) -> Optional[int]:
+        index = next((i for i, rule in enumerate(self.rules) if rule.matches(location, kind, volume)), None)
+        self._cache[key] = index
+        return index
+
+    def group(self, packages: List[dict], kinds: Optional[Sequence[str]]) -> Dict[int, List[dict]]:
+        """
+        Packages grouped by the index of their rule (packages no rule matches are left out).
+        `kinds` may be None when no rule looks at kinds.
+        """
+        if self.first_rule_only:
+            return {0: packages}
+        cache = self._cache
+        use_location, use_kind, bounds = self.use_location, self.use_kind, self.bounds
+        if not use_kind:
+            kinds = [""] * len(packages)
+        groups: Dict[int, List[dict]] = {}
+        for pkg, kind in zip(packages, kinds):
+            location = pkg.get("location", "") if use_location else ""
+            volume = pkg.get("volume", 0)
+            key = (location, kind if use_kind else "", bisect_right(bounds, volume) if bounds else 0)
+            index = cache[key] if key in cache else self._select(key, location, kind, volume)
+            if index is not None:
+                group = groups.get(index)
+                if group is None:
+                    group = groups[index] = []
+                group.append(pkg)
+        return groups
+
+
+def _price_by_factors(rule: PricingRule, packages: Iterable[dict]) -> Tuple[int, int, int, int]:
+    """
+    price_packages for rules whose min markup and cap are whole multiples (the default 1x / 3x):
+    retail is compared against price * factor directly, as the old loop did.
+    """
+    missing_bp, floor_bp = rule.missing_bp, rule.floor_bp
+    markup_factor, cap_factor = rule.min_markup_bp // BP, rule.cap_bp // BP
+    missing = floor = cap = skipped = 0
+    for pkg in packages:
+        try:
+            price = pkg["price"]
+            retail = pkg["retailPrice"]
+        except KeyError:
+            skipped += 1
+            continue
+        if price.__class__ is not int:
+            price = pkg["price"] = int(round(price))
+        if retail == 0:
+            pkg["retailPrice"] = price * missing_bp // BP
+            missing += 1
+        elif 0 < retail <= price * markup_factor:
+            pkg["retailPrice"] = price * floor_bp // BP
+            floor += 1
+        elif retail > (capped := price * cap_factor):
+            pkg["retailPrice"] = capped
+            cap += 1
+        elif retail.__class__ is not int:
+            pkg["retailPrice"] = int(round(retail))
+    return missing, floor, cap, skipped
+
+
+def _price_by_bp(rule: PricingRule, packages: Iterable[dict]) -> Tuple[int, int, int, int]:
+    """price_packages for any rule, comparing in basis points."""
+    missing_bp, min_markup_bp, floor_bp, cap_bp = rule.missing_bp, rule.min_markup_bp, rule.floor_bp, rule.cap_bp
+    missing = floor = cap = skipped = 0
+    for pkg in packages:
+        try:
+            price = pkg["price"]
+            retail = pkg["retailPrice"]
+        except KeyError:
+            skipped += 1
+            continue
+        if price.__class__ is not int:
+            price = pkg["price"] = int(round(price))
+        if retail == 0:
+            pkg["retailPrice"] = price * missing_bp // BP
+            missing += 1
+        elif 0 < retail * BP <= price * min_markup_bp:
+            pkg["retailPrice"] = price * floor_bp // BP
+            floor += 1
+        elif retail * BP > price * cap_bp:
+            pkg["retailPrice"] = price * cap_bp // BP
+            cap += 1
+        elif retail.__class__ is not int:
+            pkg["retailPrice"] = int(round(retail))
+    return missing, floor, cap, skipped
+
+
+def price_packages(rule: PricingRule, packages: List[dict]) -> Tuple[int, int, int, int]:
+    """
+    Set retailPrice of every package with both price and retailPrice by `rule`, converting
+    both to integer minor units. Returns how many were (missing, floor, cap, kept).
+    """
+    if rule.min_markup_bp % BP == 0 and rule.cap_bp % BP == 0:
+        missing, floor, cap, skipped = _price_by_factors(rule, packages)
+    else:
+        missing, floor, cap, skipped = _price_by_bp(rule, packages)
+    return missing, floor, cap, len(packages) - skipped - missing - floor - cap
+
+
+ACTIONS = ("missing", "floor", "cap", "kept")
+
+
+def apply_pricing(
+    packages: List[dict],
+    kinds: Optional[Sequence[str]],
+    rules: Sequence[PricingRule] = None,
+    selector: RuleSelector = None
+) -> Counter:
+    """
+    Set retailPrice of every package that has both price and retailPrice.
+    `kinds` holds the kind of each package (or None if no rule uses kinds).
+    Returns how often each "rule:action" fired.
+    """
+    rules = rules if rules is not None else load_rules()
+    selector = selector or RuleSelector(rules)
+
+    fired = Counter()
+    for index, group in selector.group(packages, kinds).items():
+        rule = rules[index]
+        for action, count in zip(ACTIONS, price_packages(rule, group)):
+            if count:
+                fired[f"{rule.name}:{action}"] += count
+    return fired
+
+
+def price_catalog(files: Dict[str, List[dict]], rules: Sequence[PricingRule] = None) -> Counter:
+    """
+    Price the fetched package lists in place. A package's kind comes from the list it is
+    published in (global, then regional, else local), so a package that also appears in
+    allPackages.json gets the same retail price everywhere.
+    """
+    rules = rules if rules is not None else load_rules()
+    selector = RuleSelector(rules)
+    kind_by_code = {}
+    if selector.use_kind:
+        for filename, kind in (("regionalPackages.json", KIND_REGIONAL), ("globalPackages.json", KIND_GLOBAL)):
+            for pkg in files.get(filename, []):
+                kind_by_code[pkg.get("packageCode")] = kind
+
+    fired = Counter()
+    for packages in files.values():
+        kinds = None
+        if selector.use_kind:
+            kinds = [kind_by_code.get(pkg.get("packageCode"), KIND_LOCAL) for pkg in packages]
+        fired.update(apply_pricing(packages, kinds, rules, selector))
+    return fired
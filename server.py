@@ -1,21 +1,26 @@
 import os
 import sys
-import requests
 import json
+import hmac
 import time
 import threading
 import traceback
 import asyncio
-from fastapi import FastAPI, HTTPException
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
 from dotenv import load_dotenv
 from auth import router as auth_router
-from database import engine, Base  # Import engine and Base for DB initialization
+from database import engine, Base, pool_metrics, run_db  # Import engine and Base for DB initialization
+from models import migrate_schema
 import buy_esim
+import snapshots
+import catalog
+import pricing
+import price_history
 from support_bot import create_bot_app
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 
 # Load environment variables
 load_dotenv()
@@ -35,16 +40,98 @@ app.include_router(auth_router)
 
 # Create tables if they do not already exist
 Base.metadata.create_all(bind=engine)
+migrate_schema(engine)
 print("[DEBUG] All tables created (if not already present).")
 
+@app.on_event("startup")
+async def startup_http_session():
+    await buy_esim.start_http_session()
+    app.state.package_update_task = asyncio.create_task(schedule_package_updates())
+    app.state.catalog_reload_task = asyncio.create_task(CATALOG_RELOADER.watch())
+
+@app.on_event("shutdown")
+async def shutdown_http_session():
+    app.state.package_update_task.cancel()
+    app.state.catalog_reload_task.cancel()
+    await buy_esim.close_http_session()
+
+# In-memory package catalog for the API endpoints, reloaded when a new snapshot is published
+CATALOG_RELOADER = catalog.CatalogReloader()
+
 # ✅ Serve images & JSON files from the `public/` directory
 app.mount("/images", StaticFiles(directory="public/images"), name="images")
 app.mount("/static", StaticFiles(directory="build/static"), name="static")
 
+def accepted_encodings(accept_encoding: str) -> set:
+    """Content-Encodings the client accepts (q=0 entries excluded)."""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding and q > 0:
+            accepted.add(coding)
+    return accepted
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """True if an If-None-Match header ("*" or a comma-separated list of ETags) matches `etag`."""
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in tags or f"W/{etag}" in tags or "*" in tags
+
+def serve_snapshot_file(request: Request, filename: str, manifest: dict):
+    """
+    Serve a catalog snapshot file: precompressed variant picked from Accept-Encoding,
+    strong ETag (per encoding) and Last-Modified from the manifest, 304 when unchanged.
+    """
+    entry = manifest["files"][filename]
+    accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+    encoding = next(
+        (enc for enc in snapshots.ENCODING_SUFFIXES if enc in entry.get("encodings", {}) and enc in accepted),
+        None
+    )
+    etag = f'"{entry["sha256"][:32]}-{encoding}"' if encoding else f'"{entry["sha256"][:32]}"'
+    published = datetime.fromisoformat(manifest["timestamp"])
+    headers = {
+        "ETag": etag,
+        "Last-Modified": format_datetime(published, usegmt=True),
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    elif request.headers.get("if-modified-since"):
+        try:
+            if published.replace(microsecond=0) <= parsedate_to_datetime(request.headers["if-modified-since"]):
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        path = snapshots.variant_path(filename, encoding, manifest)
+    else:
+        path = snapshots.resolve_path(filename, manifest)
+    return FileResponse(path, media_type="application/json", headers=headers)
+
 # ✅ Serve JSON files from `public/` with cache control
 @app.get("/{filename}.json")
-async def serve_json(filename: str):
-    json_path = f"public/{filename}.json"
+async def serve_json(filename: str, request: Request):
+    # Package lists come from the current catalog snapshot when one is published
+    manifest = snapshots.read_manifest()
+    if manifest and f"{filename}.json" in manifest.get("files", {}):
+        return serve_snapshot_file(request, f"{filename}.json", manifest)
+
+    json_path = snapshots.resolve_path(f"{filename}.json", manifest)
     if os.path.exists(json_path):
         response = FileResponse(json_path)
         response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, private"
@@ -66,44 +153,116 @@ async def serve_index():
 async def get_bot_status():
     return {"bot_running": bot_status["running"]}
 
+# The server process uses the web pool and the sync pool (price history); the bot process logs its own
+SERVER_DB_WORKLOADS = ("web", "sync")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+@app.get("/api/v1/metrics/db")
+async def get_db_metrics(request: Request):
+    """Pool metrics of this process; requires "Authorization: Bearer <METRICS_TOKEN>" (disabled when unset)."""
+    token = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    if not METRICS_TOKEN or not hmac.compare_digest(token, METRICS_TOKEN):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return pool_metrics(SERVER_DB_WORKLOADS)
+
+@app.get("/api/v1/package/{package_code}")
+async def get_package_detail(package_code: str, request: Request):
+    """Full package (network list, description, ...) for the detail view; list views use the Slim files."""
+    current_catalog = CATALOG_RELOADER.current
+    package = current_catalog.package(package_code)
+    if package is None:
+        raise HTTPException(status_code=404, detail="Package not found")
+    # version_tag is a hex digest of the catalog version (which may be a timestamp with spaces)
+    etag = f'"{current_catalog.version_tag}-{package_code}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=package, headers=headers)
+
+@app.get("/api/v1/packages")
+async def get_locations_index(request: Request):
+    """Which countries and regions have packages (count and cheapest retail price for each)."""
+    manifest = snapshots.read_manifest()
+    if not manifest or catalog.LOCATIONS_INDEX_FILE not in manifest.get("files", {}):
+        raise HTTPException(status_code=404, detail="Catalog not published yet")
+    return serve_snapshot_file(request, catalog.LOCATIONS_INDEX_FILE, manifest)
+
+@app.get("/api/v1/packages/{location}")
+async def get_location_packages(location: str, request: Request):
+    """Slim, price-sorted packages of one country (ISO code, e.g. FR) or region (key, e.g. europe)."""
+    manifest = snapshots.read_manifest()
+    files = manifest.get("files", {}) if manifest else {}
+    for key in (location.upper(), catalog.region_key(location)):
+        if catalog.shard_filename(key) in files:
+            return serve_snapshot_file(request, catalog.shard_filename(key), manifest)
+    raise HTTPException(status_code=404, detail="No packages for this location")
+
+@app.get("/api/v1/countries/search")
+async def search_countries(q: str = "", limit: int = 10):
+    """Countries with packages matching `q` (names, ISO codes, aliases, native names; typo tolerant)."""
+    limit = max(1, min(limit, 50))
+    return {"query": q, "results": CATALOG_RELOADER.current.search_index.search(q, limit=limit)}
+
+@app.get("/api/v1/catalog/changes")
+async def get_catalog_changes(since: str = None):
+    """Package changes since catalog version `since` (or the latest diff); full=true means reload everything."""
+    changes = await asyncio.to_thread(snapshots.changes_since, since)
+    response = JSONResponse(content=changes)
+    response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, private"
+    return response
+
 # ✅ Redirect all other routes to `index.html` (SPA support)
 @app.get("/{full_path:path}")
 async def serve_react_app(full_path: str):
     return FileResponse("build/index.html")
 
 # ✅ Fetch eSIM Packages and Save to `public/`
-ESIM_API_URL = "https://api.esimaccess.com/api/v1/open/package/list"
-HEADERS = {
-    "RT-AccessCode": os.getenv("REACT_APP_ESIM_API_Access_Code"),
-    "RT-SecretKey": os.getenv("REACT_APP_ESIM_API_Secret_KEY"),
-    "Content-Type": "application/json",
-}
-
-# Setup retry session
-session = requests.Session()
-retries = Retry(
-    total=3,
-    backoff_factor=1,
-    status_forcelist=[502, 503, 504],
-    allowed_methods=["POST"]
-)
-adapter = HTTPAdapter(max_retries=retries)
-session.mount("https://", adapter)
-session.mount("http://", adapter)
-
-def adjust_prices(packages):
-    for package in packages:
-        if "retailPrice" in package and "price" in package:
-            if package["retailPrice"] == 0:
-                package["retailPrice"] = package["price"] * 3
-            elif 0 < package["retailPrice"] <= package["price"]:
-                package["retailPrice"] = package["price"] * 1.5
-            elif package["retailPrice"] > package["price"] * 3:
-                package["retailPrice"] = package["price"] * 3
-    return packages
-
-def fetch_packages():
+# Requests go through buy_esim's pooled aiohttp session (with its retry/backoff)
+ESIM_API_URL = f"{buy_esim.BASE_URL}/package/list"
+
+async def fetch_package_list(filename: str, body: dict):
+    """Fetch one package list; returns (filename, packages or None, seconds taken)."""
+    start = time.perf_counter()
+    packages = None
+    try:
+        response_data = await buy_esim.api_post(ESIM_API_URL, body, timeout=30)
+        if response_data.get("success"):
+            packages = response_data["obj"]["packageList"]
+            print(f"✅ Fetched {filename} ({len(packages)} packages)", flush=True)
+        else:
+            print(f"❌ Failed to fetch {filename}: {response_data.get('errorMsg')}", flush=True)
+    except Exception as e:
+        print(f"⚠️ Error fetching {filename}: {e}", flush=True)
+        print(traceback.format_exc())
+    return filename, packages, time.perf_counter() - start
+
+def publish_catalog(results: dict):
+    """
+    Diff against the current snapshot and publish the new one with its diff, plus the
+    plain public/*.json copies (blocking; run in a thread).
+    Returns (manifest or None if nothing changed, diff or None if there was no snapshot).
+    """
+    # The Slim projections are rebuilt from the full lists, diffing them would repeat every change
+    diff = snapshots.diff_against_current(results, derived=catalog.SLIM_FILES.values())
+    manifest = snapshots.publish_snapshot(results, diff=diff)
+    if manifest is not None:
+        # Keep the plain public/*.json copies in sync for tools that read them directly
+        # (shards only exist in the snapshot)
+        for filename, packages in results.items():
+            if "/" not in filename:
+                snapshots.atomic_write_json(f"public/{filename}", packages)
+    last_update_time = time.strftime("%Y-%m-%d %H:%M:%S")
+    snapshots.atomic_write_bytes("public/lastUpdate.txt", last_update_time.encode("utf-8"))
+    return manifest, diff
+
+# Fetched lists (the other files are projections of these)
+PRICED_FILES = ("allPackages.json", "regionalPackages.json", "globalPackages.json")
+
+async def fetch_packages():
     print("📡 Fetching package data...", flush=True)
+    started = time.perf_counter()
+    fetched_at = datetime.now(timezone.utc)
+    timings = {}
 
     package_types = [
         ("allPackages.json", {"type": "BASE"}),
@@ -111,53 +270,74 @@ def fetch_packages():
         ("globalPackages.json", {"locationCode": "!GL", "type": "BASE"}),
     ]
 
-    for filename, body in package_types:
-        try:
-            response = session.post(ESIM_API_URL, json=body, headers=HEADERS, timeout=10)
-            response_data = response.json()
-
-            if response_data.get("success"):
-                packages = response_data["obj"]["packageList"]
-                adjusted_packages = adjust_prices(packages)
-                with open(f"public/{filename}", "w", encoding="utf-8") as f:
-                    json.dump(adjusted_packages, f, indent=4)
-                print(f"✅ Saved {filename} successfully in `public/` with updated prices!", flush=True)
-            else:
-                print(f"❌ Failed to fetch {filename}: {response_data.get('errorMsg')}", flush=True)
-        except Exception as e:
-            print(f"⚠️ Error fetching {filename}: {e}", flush=True)
-            print(traceback.format_exc())
+    # All lists are fetched concurrently, so the refresh takes as long as the slowest one
+    fetched = await asyncio.gather(*(fetch_package_list(filename, body) for filename, body in package_types))
+    results = {}
+    for filename, packages, elapsed in fetched:
+        timings[f"fetch {filename}"] = elapsed
+        if packages is not None:
+            results[filename] = packages
+    timings["fetch (wall)"] = time.perf_counter() - started
+
+    # Publish all files together or not at all, so readers never see a mix of refreshes
+    if len(results) != len(package_types):
+        print("❌ Package refresh incomplete; keeping the current catalog snapshot.", flush=True)
+        return
+
+    stage_start = time.perf_counter()
+    fired = pricing.price_catalog(results)
+    print("💲 Pricing rules applied: " + ", ".join(f"{rule}={count}" for rule, count in sorted(fired.items())), flush=True)
+    results["countryPackages.json"] = [
+        package for package in results["allPackages.json"]
+        if package.get("location") and len(package["location"]) == 2
+    ]
+    results.update(catalog.slim_projections(results))
+    results.update(catalog.location_shards(results, catalog.load_json(COUNTRIES_JSON_PATH, {})))
+    timings["pricing + derive"] = time.perf_counter() - stage_start
+    print(f"✅ Filtered country-specific packages: {len(results['countryPackages.json'])} out of {len(results['allPackages.json'])}", flush=True)
 
+    stage_start = time.perf_counter()
     try:
-        with open("public/allPackages.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        country_packages = [
-            package for package in data 
-            if package.get("location") and len(package["location"]) == 2
-        ]
-
-        with open("public/countryPackages.json", "w", encoding="utf-8") as f:
-            json.dump(country_packages, f, indent=4)
-
-        print(f"✅ Filtered JSON saved successfully. Total country-specific packages: {len(country_packages)} out of {len(data)}", flush=True)
+        manifest, diff = await asyncio.to_thread(publish_catalog, results)
     except Exception as e:
-        print(f"⚠️ Error filtering country-specific packages: {e}", flush=True)
-
-    last_update_time = time.strftime("%Y-%m-%d %H:%M:%S")
-    with open("public/lastUpdate.txt", "w", encoding="utf-8") as f:
-        f.write(last_update_time)
+        print(f"⚠️ Error publishing catalog snapshot: {e}", flush=True)
+        print(traceback.format_exc())
+        return
+    timings["publish"] = time.perf_counter() - stage_start
 
-    print(f"\n✅ Packages updated at: {last_update_time}", flush=True)
-
-# ✅ Fetch packages immediately on startup
-#fetch_packages()
-
-# ✅ Periodic update of JSON files every 6 hours
-def schedule_package_updates():
+    stage_start = time.perf_counter()
+    try:
+        # A package can appear in several lists; record_prices keeps one point per code
+        recorded = await run_db(
+            price_history.record_prices,
+            [pkg for filename in PRICED_FILES for pkg in results[filename]],
+            fetched_at,
+        )
+        print(f"📈 Recorded {recorded} price changes", flush=True)
+    except Exception as e:
+        print(f"⚠️ Error recording price history: {e}", flush=True)
+    timings["price history"] = time.perf_counter() - stage_start
+    timings["total"] = time.perf_counter() - started
+
+    if manifest is None:
+        print("\n✅ Packages checked, no changes since the current snapshot", flush=True)
+    else:
+        print(f"\n✅ Packages updated (snapshot {manifest['version']})", flush=True)
+    if manifest is not None and diff is not None:
+        for filename, counts in snapshots.diff_summary(diff).items():
+            print(f"   {filename}: +{counts['added']} -{counts['removed']} ~{counts['changed']}", flush=True)
+    print("⏱️ Refresh timings: " + ", ".join(f"{stage}={seconds:.2f}s" for stage, seconds in timings.items()), flush=True)
+    return timings
+
+# ✅ Periodic update of JSON files every 6 hours, on the app's event loop
+async def schedule_package_updates():
+    # await fetch_packages()  # uncomment to fetch packages immediately on startup
     while True:
-        time.sleep(3600*6)
-        fetch_packages()
+        await asyncio.sleep(3600*6)
+        try:
+            await fetch_packages()
+        except Exception:
+            print(traceback.format_exc())
 
 def run_support_bot():
     print("🤖 Starting integrated Support Bot...")
@@ -181,8 +361,7 @@ async def get_balance():
         raise HTTPException(status_code=500, detail=f"Error checking balance: {str(e)}")
 
 
-# Run the update task and bot in background threads
-threading.Thread(target=schedule_package_updates, daemon=True).start()
+# Run the support bot in a background thread (package updates run on the app loop)
 threading.Thread(target=run_support_bot, daemon=True).start()
 
 if __name__ == "__main__":
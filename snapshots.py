@@ -0,0 +1,322 @@
+"""
+Versioned, atomically published catalog snapshots.
+
+Each fetch_packages run writes a complete set of package files into a fresh
+public/catalog/<version>/ directory (built under a temporary name and renamed into
+place), then switches public/catalog/manifest.json to it with temp-file + os.replace.
+Readers resolve files through the manifest, so they always see one complete snapshot,
+never a half-written file or a mix of two refreshes. Old snapshots are garbage-collected.
+
+Every snapshot also stores diff.json, the changes against the snapshot before it
+(added / removed / changed packages per source file, keyed by packageCode), so consumers
+can apply only the delta. Derived files (projections, shards) are not diffed; they are
+rebuilt from the source lists. A refresh that changes nothing does not publish a new snapshot.
+
+Package files are written as minified JSON together with precompressed .gz (and .br when
+the optional brotli package is installed) variants, whose hashes and sizes are recorded in
+the manifest so the server can answer with ETags and 304s without touching the files.
+"""
+
+import os
+import gzip
+import json
+import uuid
+import shutil
+import hashlib
+import logging
+import tempfile
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip variants are written without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_DIR = "public"
+SNAPSHOT_DIRNAME = "catalog"
+MANIFEST_FILENAME = "manifest.json"
+DIFF_FILENAME = "diff.json"
+KEEP_SNAPSHOTS = int(os.getenv("CATALOG_KEEP_SNAPSHOTS", "3"))
+
+# Content-Encoding -> file suffix of the precompressed variants
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def snapshot_root(public_dir: str = PUBLIC_DIR) -> str:
+    return os.path.join(public_dir, SNAPSHOT_DIRNAME)
+
+
+def manifest_path(public_dir: str = PUBLIC_DIR) -> str:
+    return os.path.join(snapshot_root(public_dir), MANIFEST_FILENAME)
+
+
+def atomic_write_bytes(path: str, data: bytes) -> None:
+    """Write `data` to a temp file next to `path`, fsync it and rename it over `path`."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file 0600; published files have to stay readable like before
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def dump_json_bytes(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def compress(data: bytes) -> Dict[str, bytes]:
+    """Precompressed variants of `data` by Content-Encoding."""
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=11)
+    return variants
+
+
+def _write_file(path: str, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def atomic_write_json(path: str, obj: Any) -> None:
+    atomic_write_bytes(path, dump_json_bytes(obj))
+
+
+def new_version() -> str:
+    """Chronologically sortable, unique snapshot version, e.g. 20250417T062200123456-1a2b3c."""
+    return f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:6]}"
+
+
+def _read_json_file(path: str) -> Optional[Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.error(f"[Snapshots] Failed to read {path}: {e}")
+        return None
+
+
+def read_manifest(public_dir: str = PUBLIC_DIR) -> Optional[dict]:
+    """The manifest of the current snapshot, or None if nothing was published yet."""
+    return _read_json_file(manifest_path(public_dir))
+
+
+def read_diff(version: str, public_dir: str = PUBLIC_DIR) -> Optional[dict]:
+    """The diff stored with snapshot `version`, or None if it has none (or was removed)."""
+    return _read_json_file(os.path.join(snapshot_root(public_dir), version, DIFF_FILENAME))
+
+
+def resolve_path(filename: str, manifest: Optional[dict] = None, public_dir: str = PUBLIC_DIR) -> str:
+    """
+    Path of `filename` in the current snapshot if it is part of it,
+    otherwise the plain file in public/.
+    """
+    if manifest is None:
+        manifest = read_manifest(public_dir)
+    if manifest and filename in manifest.get("files", {}):
+        return os.path.join(snapshot_root(public_dir), manifest["version"], filename)
+    return os.path.join(public_dir, filename)
+
+
+def variant_path(filename: str, encoding: str, manifest: dict, public_dir: str = PUBLIC_DIR) -> str:
+    """Path of the `encoding` (e.g. "gzip") variant of a file in the snapshot of `manifest`."""
+    return resolve_path(filename, manifest, public_dir) + ENCODING_SUFFIXES[encoding]
+
+
+def diff_packages(old: List[dict], new: List[dict]) -> dict:
+    """
+    Changes from `old` to `new`, keyed by packageCode:
+    added packages, removed codes, and changed packages with {field: [old, new]}.
+    """
+    old_by_code = {pkg.get("packageCode"): pkg for pkg in old}
+    new_by_code = {pkg.get("packageCode"): pkg for pkg in new}
+
+    added = [pkg for code, pkg in new_by_code.items() if code not in old_by_code]
+    removed = [code for code in old_by_code if code not in new_by_code]
+    changed = []
+    for code, pkg in new_by_code.items():
+        previous = old_by_code.get(code)
+        if previous is None or previous == pkg:
+            continue
+        fields = {
+            field: [previous.get(field), pkg.get(field)]
+            for field in sorted(set(previous) | set(pkg))
+            if previous.get(field) != pkg.get(field)
+        }
+        changed.append({"packageCode": code, "fields": fields, "package": pkg})
+    return {"added": added, "removed": removed, "changed": changed}
+
+
+def diff_is_empty(diff: dict) -> bool:
+    return not any(
+        changes["added"] or changes["removed"] or changes["changed"]
+        for changes in diff["files"].values()
+    )
+
+
+def diff_summary(diff: dict) -> Dict[str, Dict[str, int]]:
+    return {
+        filename: {kind: len(changes[kind]) for kind in ("added", "removed", "changed")}
+        for filename, changes in diff["files"].items()
+    }
+
+
+def _is_diffed(filename: str, derived: Iterable[str]) -> bool:
+    return "/" not in filename and filename not in derived
+
+
+def diff_against_current(
+    files: Dict[str, list],
+    public_dir: str = PUBLIC_DIR,
+    derived: Iterable[str] = ()
+) -> Optional[dict]:
+    """
+    Diff the top-level source package files in `files` against the current snapshot.
+    Files in subdirectories (shards, index) and the top-level files named in `derived`
+    (e.g. the Slim projections) are built from those and not diffed.
+    None if there is no snapshot yet or it does not contain the same source files.
+    """
+    derived = set(derived)
+    files = {filename: packages for filename, packages in files.items() if _is_diffed(filename, derived)}
+    manifest = read_manifest(public_dir)
+    previous_files = {
+        filename for filename in manifest.get("files", {}) if _is_diffed(filename, derived)
+    } if manifest else None
+    if previous_files != set(files):
+        return None
+    diff_files = {}
+    for filename, packages in files.items():
+        with open(resolve_path(filename, manifest, public_dir), "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        diff_files[filename] = diff_packages(previous, packages)
+    return {"previousVersion": manifest["version"], "files": diff_files}
+
+
+def changes_since(since: Optional[str], public_dir: str = PUBLIC_DIR) -> dict:
+    """
+    Diffs needed to go from snapshot `since` to the current one, oldest first.
+    "full" is True when that chain is not available any more (unknown or garbage-collected
+    version); the consumer then has to reload the complete package files.
+    Without `since`, returns the diff of the current snapshot only.
+    """
+    manifest = read_manifest(public_dir)
+    if not manifest:
+        return {"version": None, "since": since, "full": True, "changes": []}
+    current = manifest["version"]
+
+    changes = []
+    version = current
+    while version != since:
+        diff = read_diff(version, public_dir)
+        if diff is None:
+            return {"version": current, "since": since, "full": True, "changes": []}
+        changes.append(diff)
+        if since is None:
+            break
+        version = diff["previousVersion"]
+    changes.reverse()
+    return {"version": current, "since": since, "full": False, "changes": changes}
+
+
+def publish_snapshot(
+    files: Dict[str, list],
+    public_dir: str = PUBLIC_DIR,
+    keep: int = KEEP_SNAPSHOTS,
+    diff: Optional[dict] = None,
+    derived: Iterable[str] = ()
+) -> Optional[dict]:
+    """
+    Write `files` (filename -> package list) as a new snapshot, switch the manifest
+    to it and garbage-collect old snapshots. Returns the new manifest.
+
+    `diff` is the result of diff_against_current for `files` (computed here if not
+    given, with `derived` as the files left out of it). When nothing changed, no snapshot is written and None is returned.
+    """
+    if diff is None:
+        diff = diff_against_current(files, public_dir, derived)
+    if diff is not None and diff_is_empty(diff):
+        logger.info(f"[Snapshots] No package changes since {diff['previousVersion']}, nothing published")
+        return None
+
+    root = snapshot_root(public_dir)
+    version = new_version()
+    tmp_dir = os.path.join(root, f".tmp-{version}")
+    final_dir = os.path.join(root, version)
+    os.makedirs(tmp_dir)
+
+    try:
+        file_entries = {}
+        for filename, packages in files.items():
+            data = dump_json_bytes(packages)
+            os.makedirs(os.path.dirname(os.path.join(tmp_dir, filename)), exist_ok=True)
+            _write_file(os.path.join(tmp_dir, filename), data)
+            encodings = {}
+            for encoding, compressed in compress(data).items():
+                _write_file(os.path.join(tmp_dir, filename + ENCODING_SUFFIXES[encoding]), compressed)
+                encodings[encoding] = {"bytes": len(compressed)}
+            file_entries[filename] = {
+                "sha256": hashlib.sha256(data).hexdigest(),
+                "count": len(packages),
+                "bytes": len(data),
+                "encodings": encodings,
+            }
+
+        manifest = {
+            "version": version,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "files": file_entries,
+            "previousVersion": None,
+        }
+        if diff is not None:
+            diff = {"version": version, "timestamp": manifest["timestamp"], **diff}
+            with open(os.path.join(tmp_dir, DIFF_FILENAME), "wb") as f:
+                f.write(json.dumps(diff, separators=(",", ":")).encode("utf-8"))
+            manifest["previousVersion"] = diff["previousVersion"]
+            manifest["changes"] = diff_summary(diff)
+        with open(os.path.join(tmp_dir, MANIFEST_FILENAME), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=4)
+        os.rename(tmp_dir, final_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    atomic_write_json(manifest_path(public_dir), manifest)
+    logger.info(f"[Snapshots] Published catalog snapshot {version}")
+    gc_snapshots(public_dir, keep=keep)
+    return manifest
+
+
+def gc_snapshots(public_dir: str = PUBLIC_DIR, keep: int = KEEP_SNAPSHOTS) -> None:
+    """Delete all but the newest `keep` snapshots (never the current one) and leftover temp dirs."""
+    root = snapshot_root(public_dir)
+    if not os.path.isdir(root):
+        return
+    manifest = read_manifest(public_dir)
+    current = manifest.get("version") if manifest else None
+
+    entries = sorted(
+        name for name in os.listdir(root)
+        if os.path.isdir(os.path.join(root, name))
+    )
+    versions = [name for name in entries if not name.startswith(".")]
+    stale = [name for name in entries if name.startswith(".tmp-")]
+    stale += [name for name in versions[:-keep] if name != current] if keep > 0 else []
+
+    for name in stale:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        logger.info(f"[Snapshots] Removed old snapshot {name}")
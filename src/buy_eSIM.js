@@ -62,7 +62,7 @@ const BuyESIM = () => {
     useEffect(() => {
         if (regionIcons && Object.keys(regionIcons).length > 0) {
             setRegions(Object.keys(regionIcons));
-            fetch("/regionalPackages.json")
+            fetch("/regionalPackagesSlim.json")
                 .then((response) => response.json())
                 .then((data) => {
                     setPackages(data);
@@ -99,7 +99,7 @@ const BuyESIM = () => {
     };
 
     useEffect(() => {
-        fetch("/countryPackages.json")
+        fetch("/countryPackagesSlim.json")
             .then(response => response.json())
             .then(data => {
                 const uniqueCountryCodes = [...new Set(data.map(pkg => pkg.location))];
@@ -125,7 +125,7 @@ const BuyESIM = () => {
 
     useEffect(() => {
         let isMounted = true;
-        fetch("/globalPackages.json")
+        fetch("/globalPackagesSlim.json")
             .then((response) => response.json())
             .then((data) => {
                 if (isMounted) setGlobalPackages(data);
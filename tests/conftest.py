@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# The modules read DATABASE_URL at import time; point them at a throwaway SQLite file.
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,34 @@
+import json
+
+import bot
+import buy_esim
+from database import SyncSessionLocal, engines
+from models import Order
+from test_query_counts import count_statements, seed_orders
+
+
+def test_backfill_fills_from_esim_list_and_index_and_skips_unmatched(monkeypatch):
+    monkeypatch.setattr(buy_esim, "_backfill_unmatched", set())
+    iccids = seed_orders(3)
+    with SyncSessionLocal() as session:
+        orders = session.query(Order).order_by(Order.id).all()
+        orders[0].esim_list = json.dumps([{"esimTranNo": "T0"}])
+        session.commit()
+
+    assert buy_esim.backfill_esim_tran_nos({iccids[1]: {"esimTranNo": "T1"}}) == 2
+    with SyncSessionLocal() as session:
+        assert [order.esim_tran_no for order in session.query(Order).order_by(Order.id)] == ["T0", "T1", None]
+
+    # The unmatched order is remembered and not parsed again; nothing left to write
+    with count_statements(engines["sync"]) as statements:
+        assert buy_esim.backfill_esim_tran_nos({}) == 0
+    assert len(statements) == 1
+
+
+def test_order_tran_no_prefers_the_indexed_column():
+    order = Order(iccid="8910", esim_tran_no="T9", esim_list=json.dumps([{"esimTranNo": "T0"}]))
+    assert bot.order_tran_no(order) == "T9"
+    order.esim_tran_no = None
+    assert bot.order_tran_no(order) == "T0"
+    order.esim_list = "not json"
+    assert bot.order_tran_no(order) is None
@@ -0,0 +1,31 @@
+import asyncio
+import threading
+
+import buy_esim
+
+
+def test_one_session_per_event_loop():
+    async def main():
+        session = await buy_esim.get_http_session()
+        assert await buy_esim.start_http_session() is session
+
+        # Another loop (e.g. the support bot thread) gets its own session and leaves ours alone
+        other = {}
+
+        def run_other_loop():
+            async def use_session():
+                other["session"] = await buy_esim.get_http_session()
+                await buy_esim.close_http_session()
+            asyncio.run(use_session())
+
+        thread = threading.Thread(target=run_other_loop)
+        thread.start()
+        thread.join()
+        assert other["session"] is not session and other["session"].closed
+        assert not session.closed
+        assert await buy_esim.get_http_session() is session
+
+        await buy_esim.close_http_session()
+        assert session.closed
+
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+import random
+
+import pricing
+
+GB_1 = pricing.GB
+
+
+def adjust_prices(packages):
+    """The loop server.py used before pricing.py."""
+    for package in packages:
+        if "retailPrice" in package and "price" in package:
+            if package["retailPrice"] == 0:
+                package["retailPrice"] = package["price"] * 3
+            elif 0 < package["retailPrice"] <= package["price"]:
+                package["retailPrice"] = package["price"] * 1.5
+            elif package["retailPrice"] > package["price"] * 3:
+                package["retailPrice"] = package["price"] * 3
+    return packages
+
+
+def make_packages(count=500):
+    rng = random.Random(7)
+    packages = []
+    for i in range(count):
+        price = rng.randrange(1000, 500000)
+        retail = rng.choice((0, price // 2, price, price + 1, price * 2, price * 3, price * 3 + 1, price * 7))
+        packages.append({"packageCode": f"P{i}", "location": "DE", "volume": GB_1, "price": price, "retailPrice": retail})
+    packages.append({"packageCode": "no-retail", "price": 1000})
+    return packages
+
+
+def test_default_rule_matches_old_loop():
+    old = adjust_prices(make_packages())
+    new = make_packages()
+    fired = pricing.price_catalog({"allPackages.json": new})
+    for before, after in zip(old, new):
+        assert after.get("retailPrice") == (int(before["retailPrice"]) if "retailPrice" in before else None)
+        assert after.get("retailPrice") is None or type(after["retailPrice"]) is int
+        assert "pricingRule" not in after
+    assert sum(fired.values()) == len(new) - 1
+    assert set(fired) <= {f"default:{action}" for action in pricing.ACTIONS}
+
+
+def test_fractional_rule_compares_in_basis_points():
+    rule = pricing.PricingRule("fine", min_markup_bp=12500, floor_bp=20000, cap_bp=27500)
+    packages = [
+        {"price": 1000, "retailPrice": 1250},   # at the 1.25x markup: floor
+        {"price": 1000, "retailPrice": 1251},   # kept
+        {"price": 1000, "retailPrice": 2750},   # at the cap: kept
+        {"price": 1000, "retailPrice": 2751.5},  # above the cap
+        {"price": 1000, "retailPrice": 2000.4},  # kept, rounded
+    ]
+    fired = pricing.price_catalog({"allPackages.json": packages}, [rule])
+    assert [pkg["retailPrice"] for pkg in packages] == [2000, 1251, 2750, 2750, 2000]
+    assert fired == {"fine:floor": 1, "fine:kept": 3, "fine:cap": 1}
+
+
+def test_rules_by_kind_and_volume():
+    rules = [
+        pricing.PricingRule("global", kinds=[pricing.KIND_GLOBAL], cap_bp=20000),
+        pricing.PricingRule("big", min_volume_gb=10, cap_bp=25000),
+        *pricing.DEFAULT_RULES,
+    ]
+    files = {
+        "allPackages.json": [
+            {"packageCode": "G", "volume": GB_1, "price": 100, "retailPrice": 1000},
+            {"packageCode": "L", "volume": 20 * GB_1, "price": 100, "retailPrice": 1000},
+            {"packageCode": "S", "volume": GB_1, "price": 100, "retailPrice": 1000},
+        ],
+        "globalPackages.json": [{"packageCode": "G", "volume": GB_1, "price": 100, "retailPrice": 1000}],
+    }
+    fired = pricing.price_catalog(files, rules)
+    assert [pkg["retailPrice"] for pkg in files["allPackages.json"]] == [200, 250, 300]
+    assert files["globalPackages.json"][0]["retailPrice"] == 200
+    assert fired == {"global:cap": 2, "big:cap": 1, "default:cap": 1}
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+import buy_esim
+
+PAGE_SIZE = buy_esim.ESIM_QUERY_PAGE_SIZE
+
+
+def fake_api(responses):
+    """api_post stand-in answering /esim/query with the given responses, page by page."""
+    async def api_post(url, payload, timeout=30, **kwargs):
+        return responses[payload["pager"]["pageNum"] - 1]
+    return api_post
+
+
+def page(start, count, total):
+    profiles = [{"iccid": f"8910{i:05d}", "esimTranNo": f"T{i}"} for i in range(start, start + count)]
+    return {"success": True, "obj": {"esimList": profiles, "pager": {"total": total}}}
+
+
+FAILED = {"success": False, "errorMsg": "system busy"}
+
+
+@pytest.fixture
+def index():
+    return buy_esim.ProfileIndex()
+
+
+def test_refresh_indexes_every_page(monkeypatch, index):
+    monkeypatch.setattr(buy_esim, "api_post", fake_api([page(0, PAGE_SIZE, PAGE_SIZE + 5), page(PAGE_SIZE, 5, PAGE_SIZE + 5)]))
+    assert asyncio.run(index.refresh(max_age=0)) is True
+    assert len(index.by_iccid) == PAGE_SIZE + 5
+
+
+def test_refresh_keeps_previous_index_when_a_later_page_fails(monkeypatch, index):
+    monkeypatch.setattr(buy_esim, "api_post", fake_api([page(0, 3, 3)]))
+    assert asyncio.run(index.refresh(max_age=0)) is True
+    previous = dict(index.by_iccid)
+
+    monkeypatch.setattr(buy_esim, "api_post", fake_api([page(0, PAGE_SIZE, 2 * PAGE_SIZE), FAILED]))
+    assert asyncio.run(index.refresh(max_age=0)) is False
+    assert index.by_iccid == previous
+
+
+def test_query_allocated_profiles_returns_nothing_for_a_partial_listing(monkeypatch):
+    monkeypatch.setattr(buy_esim, "api_post", fake_api([page(0, PAGE_SIZE, 2 * PAGE_SIZE), FAILED]))
+    assert asyncio.run(buy_esim.query_allocated_profiles()) == []
+
+
+def test_refresh_keeps_previous_index_when_the_first_page_fails(monkeypatch, index):
+    monkeypatch.setattr(buy_esim, "api_post", fake_api([page(0, 3, 3)]))
+    assert asyncio.run(index.refresh(max_age=0)) is True
+    previous, loaded_at = dict(index.by_iccid), index.loaded_at
+
+    monkeypatch.setattr(buy_esim, "api_post", fake_api([FAILED]))
+    assert asyncio.run(index.refresh(max_age=0)) is False
+    assert index.by_iccid == previous
+    assert index.loaded_at == loaded_at
+
+
+def test_usage_sync_skips_the_run_without_an_index(monkeypatch):
+    monkeypatch.setattr(buy_esim, "profile_index", buy_esim.ProfileIndex())
+    monkeypatch.setattr(buy_esim, "_load_active_orders", lambda: [(1, "89100001"), (2, "89100002")])
+    monkeypatch.setattr(buy_esim, "api_post", fake_api([FAILED]))
+
+    async def unexpected_lookup(*args, **kwargs):
+        raise AssertionError("per-ICCID lookup without an index")
+    monkeypatch.setattr(buy_esim, "_fetch_esim_entry", unexpected_lookup)
+
+    assert asyncio.run(buy_esim.sync_usage_once()) == 0
@@ -0,0 +1,77 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import delete, event
+
+import bot
+import buy_esim
+from database import Base, SyncSessionLocal, engine, engines
+from models import Order
+
+
+@contextmanager
+def count_statements(db_engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db_engine, "before_cursor_execute", before_cursor_execute)
+
+
+def seed_orders(count, user_id="42"):
+    Base.metadata.create_all(bind=engine)
+    with SyncSessionLocal() as session:
+        session.execute(delete(Order))
+        session.add_all(
+            Order(user_id=user_id, package_code="P1", order_id=f"O{i}", iccid=f"8910{i:04d}", order_usage=0)
+            for i in range(count)
+        )
+        session.commit()
+    return [f"8910{i:04d}" for i in range(count)]
+
+
+@pytest.mark.parametrize("count", [1, 10, 100])
+def test_update_usage_bulk_statement_count_is_constant(count):
+    iccids = seed_orders(count)
+    usage = {iccid: {"orderUsage": 1024, "lastUpdateTime": "2025-04-17T06:22:00+00:00"} for iccid in iccids}
+
+    with count_statements(engines["sync"]) as statements:
+        with SyncSessionLocal() as session:
+            assert buy_esim.update_usage_bulk(session, usage) == count
+
+    # One SELECT ... IN (...) and one executemany UPDATE, whatever the number of orders
+    assert len(statements) == 2, statements
+
+
+@pytest.mark.parametrize("count", [1, 10, 100])
+def test_load_user_orders_is_a_single_query(count):
+    seed_orders(count)
+
+    with count_statements(engines["bot"]) as statements:
+        orders = bot.load_user_orders("42")
+
+    assert len(orders) == count
+    assert len(statements) == 1, statements
+
+
+def test_update_usage_bulk_stores_status_and_expiry():
+    iccids = seed_orders(2)
+    data = {
+        "orderUsage": 2048,
+        "esimStatus": "IN_USE",
+        "smdpStatus": "ENABLED",
+        "expiredTime": "2025-05-17T06:22:00+00:00",
+        "lastUpdateTime": "2025-04-17T06:22:00+00:00",
+    }
+    with SyncSessionLocal() as session:
+        buy_esim.update_usage_bulk(session, {iccid: data for iccid in iccids})
+
+    with SyncSessionLocal() as session:
+        for order in session.query(Order).all():
+            assert (order.order_usage, order.esim_status, order.smdp_status) == (2048, "IN_USE", "ENABLED")
+            assert order.expired_time is not None and order.last_update_time is not None
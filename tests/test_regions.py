@@ -0,0 +1,46 @@
+import json
+import os
+
+import pytest
+
+import catalog
+
+PUBLIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "public")
+
+
+def load_regional_packages():
+    with open(os.path.join(PUBLIC_DIR, "regionalPackages.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_location_regions_match_name_predicates():
+    """Grouping by location codes puts every published package where the old name predicates did."""
+    packages = load_regional_packages()
+    assert packages
+    for pkg in packages:
+        by_name = [region for region, predicate in catalog.REGION_ICONS.items() if predicate(pkg)]
+        assert by_name == [catalog.package_region(pkg)], pkg["name"]
+
+
+def test_catalog_region_groups_match_name_predicates():
+    packages = load_regional_packages()
+    by_region = catalog.Catalog({}, [], packages, []).by_region
+    for region, predicate in catalog.REGION_ICONS.items():
+        expected = {pkg["packageCode"] for pkg in packages if predicate(pkg)}
+        assert {pkg["packageCode"] for pkg in by_region.get(region, [])} == expected, region
+
+
+@pytest.mark.parametrize("name, locations, region", [
+    ("Japan & South Korea", "JP,KR", "Asia (excl. China)"),
+    ("China mainland & Japan & South Korea", "CN,JP,KR", "China"),
+    ("Gulf 6", "AE,BH,KW,OM,QA,SA", "Gulf"),
+    ("Middle East 8", "AE,BH,EG,IL,JO,KW,QA,SA", "Middle East"),
+    ("Europe 30", "DE,FR,IT,ES,NL,BE,AT,PL", "Europe"),
+])
+def test_package_region_by_locations(name, locations, region):
+    assert catalog.package_region({"name": name, "location": locations}) == region
+
+
+def test_package_region_falls_back_to_name():
+    assert catalog.package_region({"name": "Caribbean 20", "location": ""}) == "Caribbean"
+    assert catalog.package_region({"name": "Somewhere", "location": ""}) is None
@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+from sqlalchemy import text
+
+from database import BotSessionLocal, run_db
+
+USERS = 50
+QUERY_DELAY = 0.02  # simulated slow query, blocking the calling thread
+
+
+def slow_query() -> int:
+    with BotSessionLocal() as session:
+        value = session.execute(text("SELECT 1")).scalar()
+    time.sleep(QUERY_DELAY)
+    return value
+
+
+async def max_loop_lag(handler) -> float:
+    """Worst event-loop stall seen by a 1 ms ticker while USERS handlers run concurrently."""
+    lag = 0.0
+    done = asyncio.Event()
+
+    async def probe():
+        nonlocal lag
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            start = loop.time()
+            await asyncio.sleep(0.001)
+            lag = max(lag, loop.time() - start - 0.001)
+
+    probe_task = asyncio.create_task(probe())
+    await asyncio.sleep(0.01)
+    results = await asyncio.gather(*(handler() for _ in range(USERS)))
+    done.set()
+    await probe_task
+    assert results == [1] * USERS
+    return lag
+
+
+def test_run_db_keeps_event_loop_responsive():
+    async def handler():
+        return await run_db(slow_query)
+
+    async def blocking_handler():
+        return slow_query()
+
+    lag = asyncio.run(max_loop_lag(handler))
+    blocking_lag = asyncio.run(max_loop_lag(blocking_handler))
+
+    # Calling the query on the loop stalls it for every user in turn; run_db must not
+    assert blocking_lag > USERS * QUERY_DELAY * 0.5
+    assert lag < 0.1, f"event loop stalled for {lag * 1000:.1f} ms"
@@ -0,0 +1,23 @@
+from sqlalchemy import create_engine, inspect, text
+
+from models import Base, migrate_schema
+
+
+def test_migrate_schema_adds_missing_order_columns(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        # orders as created before esim_tran_no existed
+        conn.execute(text("DROP INDEX ix_orders_esim_tran_no"))
+        conn.execute(text("ALTER TABLE orders DROP COLUMN esim_tran_no"))
+        conn.execute(text("INSERT INTO orders (package_code, iccid) VALUES ('P1', '8910')"))
+
+    migrate_schema(engine)
+    migrate_schema(engine)  # idempotent
+
+    inspector = inspect(engine)
+    assert "esim_tran_no" in {column["name"] for column in inspector.get_columns("orders")}
+    assert "ix_orders_esim_tran_no" in {index["name"] for index in inspector.get_indexes("orders")}
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT iccid, esim_tran_no FROM orders")).all()
+    assert rows == [("8910", None)]
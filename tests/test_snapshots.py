@@ -0,0 +1,39 @@
+import catalog
+import snapshots
+
+
+def package(code, retail_price):
+    return {"packageCode": code, "name": code, "price": 10000, "retailPrice": retail_price, "location": "DE"}
+
+
+def catalog_files(retail_price):
+    files = {
+        "allPackages.json": [package("A", retail_price), package("B", 30000)],
+        "countryPackages.json": [package("A", retail_price), package("B", 30000)],
+        "regionalPackages.json": [],
+        "globalPackages.json": [],
+    }
+    files.update(catalog.slim_projections(files))
+    return files
+
+
+def test_diff_covers_source_lists_only(tmp_path):
+    public_dir = str(tmp_path)
+    derived = catalog.SLIM_FILES.values()
+    snapshots.publish_snapshot(catalog_files(20000), public_dir, derived=derived)
+
+    manifest = snapshots.publish_snapshot(catalog_files(25000), public_dir, derived=derived)
+    diff = snapshots.read_diff(manifest["version"], public_dir)
+
+    assert set(diff["files"]) == {"allPackages.json", "countryPackages.json", "regionalPackages.json", "globalPackages.json"}
+    changed = diff["files"]["countryPackages.json"]["changed"]
+    assert [(change["packageCode"], change["fields"]) for change in changed] == [("A", {"retailPrice": [20000, 25000]})]
+    # The projections are still published in the snapshot
+    assert "countryPackagesSlim.json" in manifest["files"]
+
+
+def test_unchanged_refresh_publishes_nothing(tmp_path):
+    public_dir = str(tmp_path)
+    derived = catalog.SLIM_FILES.values()
+    assert snapshots.publish_snapshot(catalog_files(20000), public_dir, derived=derived) is not None
+    assert snapshots.publish_snapshot(catalog_files(20000), public_dir, derived=derived) is None
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from buy_esim import AsyncTTLCache
+
+
+def test_concurrent_misses_share_one_fetch():
+    cache = AsyncTTLCache(ttl=60, maxsize=10)
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"iccid": "1"}
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_fetch("1", fetch) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert calls == 1
+    assert all(result == {"iccid": "1"} for result in results)
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_cancelled_fetcher_does_not_cancel_waiters():
+    cache = AsyncTTLCache(ttl=60, maxsize=10)
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05 if calls == 1 else 0)
+        return calls
+
+    async def main():
+        first = asyncio.create_task(asyncio.wait_for(cache.get_or_fetch("1", fetch), timeout=0.01))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.get_or_fetch("1", fetch))
+        with pytest.raises(asyncio.TimeoutError):
+            await first
+        return await second
+
+    # The waiter starts its own fetch instead of raising CancelledError
+    assert asyncio.run(main()) == 2
+    assert calls == 2